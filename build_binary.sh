@@ -170,6 +170,7 @@ def get_hidden_imports():
     """Get hidden imports for PyInstaller"""
     return [
         'yaml',
+        'yaml._yaml',
         'telegram',
         'telegram.ext',
         'telegram._vendor.ptb_urllib3',
@@ -179,8 +180,7 @@ def get_hidden_imports():
         'requests',
         'urllib3',
         'charset_normalizer',
-        'idna',
-        'schedule'
+        'idna'
     ]
 
 a = Analysis(
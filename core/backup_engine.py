@@ -1,10 +1,17 @@
+import codecs
+import fcntl
 import subprocess
+import io
 import os
+import selectors
+import shlex
+import sys
 import signal
+import time
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from core.config_manager import ConfigManager
 from core.registry_manager import RegistryManager
 from hardware.tape_driver import TapeDriver
@@ -12,14 +19,35 @@ from notification.telegram_bot import TelegramBot
 
 logger = logging.getLogger(__name__)
 
+# Емкость канала tar -> mbuffer (по умолчанию в Linux 64 КБ)
+PIPE_SIZE = 1 << 20
+# fcntl.F_SETPIPE_SZ появился только в Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
 class BackupEngine:
     """Движок для выполнения операций резервного копирования"""
     
-    def __init__(self, config: ConfigManager):
+    SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+    
+    # Сколько байт stderr tar сохранять для сообщения об ошибке восстановления
+    STDERR_KEEP_BYTES = 4096
+    
+    # Таблица для str.translate: ASCII-символы, недопустимые в имени манифеста, удаляются
+    SAFE_LABEL_TABLE = {
+        i: None for i in range(128)
+        if not (chr(i).isalnum() or chr(i) in ('_', '-'))
+    }
+    
+    def __init__(self, config: ConfigManager, tape_driver: Optional[TapeDriver] = None,
+                 registry: Optional[RegistryManager] = None, bot: Optional[TelegramBot] = None):
         self.config = config
-        self.tape_driver = TapeDriver(config)
-        self.registry = RegistryManager(config)
-        self.bot = TelegramBot(config)
+        # Уже созданные компоненты передаются вызывающим кодом, чтобы
+        # реестр не читался дважды, а у Telegram был один поток отправки
+        self.tape_driver = tape_driver if tape_driver is not None else TapeDriver(config)
+        self.registry = registry if registry is not None else RegistryManager(config)
+        self.bot = bot if bot is not None else TelegramBot(config)
+        self._build_command_templates()
+        self._progress_out = None
         
         # Обработка прерываний
         signal.signal(signal.SIGINT, self._handle_interrupt)
@@ -30,6 +58,8 @@ class BackupEngine:
     def _handle_interrupt(self, signum, frame):
         """Обработка прерывания"""
         logger.warning(f"Получен сигнал прерывания {signum}")
+        if self._progress_out is not None:
+            self._progress_out.flush()
         self.bot.send_message(f"⚠️ Операция прервана сигналом {signum}")
         raise KeyboardInterrupt
     
@@ -39,7 +69,10 @@ class BackupEngine:
         Path(manifest_dir).mkdir(parents=True, exist_ok=True)
         
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        safe_label = "".join(c for c in label if c.isalnum() or c in ('_', '-'))
+        if label.isascii():
+            safe_label = label.translate(self.SAFE_LABEL_TABLE)
+        else:
+            safe_label = "".join(c for c in label if c.isalnum() or c in ('_', '-'))
         return str(Path(manifest_dir) / f"{timestamp}_{safe_label}.txt")
     
     def build_exclude_list(self) -> List[str]:
@@ -47,67 +80,114 @@ class BackupEngine:
         exclude_str = self.config.get('exclude', 'patterns', [])
         return exclude_str
     
-    def build_tar_command(self, source: str, manifest: str, block_size: str) -> str:
-        """Построить команду tar для архивации"""
-        excludes = self.build_exclude_list()
-        exclude_args = " ".join([f'--exclude="{pattern}"' for pattern in excludes])
-        
+    def _build_command_templates(self) -> None:
+        """Предвычислить неизменные части argv для tar и mbuffer"""
         backup_params = self.config.get_backup_params()
         compression = backup_params.get('compression', 'none')
         
         # Добавляем параметры сжатия если нужно
-        compression_args = ""
+        compression_args = ()
         if compression != 'none':
-            compression_args = f"--{compression}"
+            compression_args = (f"--{compression}",)
         
-        return (
-            f"tar -cv {exclude_args} {compression_args} "
-            f"--record-size={block_size} "
-            f"--index-file={manifest} "
-            f"{source}"
-        )
-    
-    def build_mbuffer_command(self, block_size: str, change_script: str) -> str:
-        """Построить команду mbuffer для буферизации"""
-        mbuffer_params = self.config.get_mbuffer_params()
+        self._tar_prefix = ("tar", "-cv", *self.config.get_exclude_args(), *compression_args)
         
-        buffer_size = mbuffer_params['size']
-        fill_percent = mbuffer_params['fill_percent']
-        min_rate = mbuffer_params.get('min_rate', '100M')
-        max_rate = mbuffer_params.get('max_rate', '150M')
+        mbuffer_params = self.config.get_mbuffer_params()
         tape_dev = self.config.get('hardware', 'tape_dev')
         
         performance_params = self.config.get_performance_params()
         use_direct_io = performance_params.get('use_direct_io', True)
         
-        direct_io_arg = "-D" if use_direct_io else ""
+        direct_io_args = ("-D",) if use_direct_io else ()
         
-        return (
-            f"mbuffer -m {buffer_size} "
-            f"-P {fill_percent} "
-            f"-b {block_size} "
-            f"-n 0 -f {direct_io_arg} "
-            f"-A '{change_script}' "
-            f"-o {tape_dev}"
+        self._mbuffer_prefix = (
+            "mbuffer", "-m", mbuffer_params.size,
+            "-P", mbuffer_params.fill_percent,
+            "-n", "0", "-f", *direct_io_args,
+            "-o", tape_dev
         )
     
+    def build_tar_command(self, source: str, manifest: str, block_size: str) -> List[str]:
+        """Построить команду tar для архивации"""
+        return [
+            *self._tar_prefix,
+            f"--record-size={block_size}",
+            f"--index-file={manifest}",
+            source
+        ]
+    
+    def build_mbuffer_command(self, block_size: str, change_script: str) -> List[str]:
+        """Построить команду mbuffer для буферизации"""
+        return [*self._mbuffer_prefix, "-b", block_size, "-A", change_script]
+    
+    def _start_pipeline(self, first_argv: List[str], second_argv: List[str],
+                        first_kwargs: Optional[Dict[str, Any]] = None,
+                        second_kwargs: Optional[Dict[str, Any]] = None):
+        """Запустить два процесса, соединенных каналом, без промежуточного shell"""
+        read_fd, write_fd = os.pipe2(os.O_CLOEXEC)
+        self._grow_pipe(write_fd)
+        try:
+            first = subprocess.Popen(first_argv, stdout=write_fd, **(first_kwargs or {}))
+            try:
+                second = subprocess.Popen(second_argv, stdin=read_fd, **(second_kwargs or {}))
+            except Exception:
+                first.kill()
+                first.wait()
+                raise
+        finally:
+            # Родителю копии концов канала не нужны, иначе читатель не получит EOF
+            os.close(read_fd)
+            os.close(write_fd)
+        
+        return first, second
+    
+    @staticmethod
+    def _quote_argv(argv: List[str]) -> str:
+        """Командная строка для журнала (shlex.join появился только в Python 3.8)"""
+        return " ".join(shlex.quote(arg) for arg in argv)
+    
+    @staticmethod
+    def _grow_pipe(fd: int) -> None:
+        """Увеличить емкость канала до PIPE_SIZE: меньше переключений между tar и mbuffer"""
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, PIPE_SIZE)
+        except OSError as e:
+            # Больше /proc/sys/fs/pipe-max-size без CAP_SYS_RESOURCE не дадут
+            logger.debug(f"Не удалось увеличить буфер канала: {e}")
+    
+    @staticmethod
+    def _stop_processes(*procs: subprocess.Popen, timeout: float = 10.0) -> None:
+        """Завершить процессы конвейера: SIGTERM, а по истечении timeout - SIGKILL"""
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        
+        for proc in procs:
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+    
     def estimate_backup_size(self, source: str) -> str:
         """Оценить размер бэкапа"""
         try:
             # Используем du для оценки размера
-            cmd = f"du -sb {source} 2>/dev/null | cut -f1"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            result = subprocess.run(
+                ["du", "-sb", "--", source],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True
+            )
             
-            if result.returncode == 0:
-                size_bytes = int(result.stdout.strip())
-                
-                # Преобразуем в читаемый формат
-                for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-                    if size_bytes < 1024.0:
-                        return f"{size_bytes:.1f} {unit}"
-                    size_bytes /= 1024.0
+            # du завершается с кодом 1 при частичных ошибках (например, нечитаемый
+            # подкаталог), но итог все равно печатает: ориентируемся на вывод
+            if result.stdout:
+                size_bytes = int(result.stdout.split('\t', 1)[0])
                 
-                return f"{size_bytes:.1f} PB"
+                # Преобразуем в читаемый формат: порядок единицы по числу бит
+                unit_idx = 0 if size_bytes <= 0 else min(5, (size_bytes.bit_length() - 1) // 10)
+                return f"{size_bytes / (1 << (unit_idx * 10)):.1f} {self.SIZE_UNITS[unit_idx]}"
             else:
                 return "Неизвестно"
                 
@@ -117,7 +197,8 @@ class BackupEngine:
     
     def backup(self, source_path: str, label: str) -> bool:
         """Выполнить резервное копирование"""
-        start_time = datetime.now()
+        start_ns = time.monotonic_ns()
+        manifest_fd = None
         
         try:
             # Очистка временных файлов
@@ -133,19 +214,19 @@ class BackupEngine:
             
             # Получение параметров конфигурации
             mbuffer_params = self.config.get_mbuffer_params()
-            block_size = mbuffer_params['block_size']
-            change_script = mbuffer_params['change_script']
+            block_size = mbuffer_params.block_size
+            change_script = mbuffer_params.change_script
             
             # Оценка размера бэкапа
             size_estimate = self.estimate_backup_size(source_path)
             
+            # Манифест пишется через заранее открытый дескриптор
+            manifest_fd = self._open_manifest(manifest_path)
+            
             # Построение команд
-            tar_cmd = self.build_tar_command(source_path, manifest_path, block_size)
+            tar_cmd = self.build_tar_command(source_path, f"/dev/fd/{manifest_fd}", block_size)
             mbuffer_cmd = self.build_mbuffer_command(block_size, change_script)
             
-            # Полная команда для выполнения
-            full_cmd = f"{tar_cmd} | {mbuffer_cmd} 2>&1"
-            
             print("=" * 60)
             print(f"🚀 Начало бэкапа: {label}")
             print(f"📁 Источник: {source_path}")
@@ -158,24 +239,31 @@ class BackupEngine:
             
             # Выполнение команды
             logger.info(f"Выполнение команды бэкапа: {label}")
-            proc = subprocess.Popen(
-                full_cmd,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("tar: %s | mbuffer: %s", self._quote_argv(tar_cmd), self._quote_argv(mbuffer_cmd))
+            tar_proc, proc = self._start_pipeline(
+                tar_cmd,
+                mbuffer_cmd,
+                first_kwargs={'pass_fds': (manifest_fd,)},
+                second_kwargs={
+                    'stdout': subprocess.PIPE,
+                    'stderr': subprocess.STDOUT,
+                    'bufsize': 65536
+                }
             )
             
-            # Вывод прогресса в реальном времени
-            for line in proc.stdout:
-                print(line, end='')
-            
-            proc.wait()
+            try:
+                # Вывод прогресса в реальном времени блоками по 64 КБ
+                self._forward_output(proc.stdout.fileno())
+                
+                proc.wait()
+                tar_proc.wait()
+            except BaseException:
+                # При прерывании не оставляем tar и mbuffer работать без родителя
+                self._stop_processes(tar_proc, proc)
+                raise
             
-            end_time = datetime.now()
-            duration = end_time - start_time
+            duration = self._elapsed(start_ns)
             
             if proc.returncode == 0:
                 self._finalize_backup(label, manifest_path, duration, size_estimate)
@@ -191,8 +279,86 @@ class BackupEngine:
             logger.error(f"Критическая ошибка при бэкапе {label}: {error_msg}")
             self.bot.send_backup_failed(label, error_msg)
             return False
+        finally:
+            if manifest_fd is not None:
+                self._close_manifest(manifest_fd)
+    
+    def _open_manifest(self, manifest_path: str) -> int:
+        """Открыть файл манифеста для последовательной записи из tar"""
+        fd = os.open(manifest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return fd
+    
+    def _close_manifest(self, fd: int) -> None:
+        """Закрыть манифест, освободив его страницы в кэше"""
+        try:
+            if hasattr(os, 'posix_fadvise'):
+                os.fdatasync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError as e:
+            logger.debug(f"Не удалось сбросить кэш манифеста: {e}")
+        finally:
+            os.close(fd)
+    
+    def _forward_output(self, fd: int) -> None:
+        """Переслать вывод процесса в stdout блоками, без построчного чтения"""
+        sys.stdout.flush()
+        
+        # На Linux перекладываем страницы из канала в stdout внутри ядра
+        if hasattr(os, 'splice'):
+            try:
+                dst = sys.stdout.fileno()
+                while os.splice(fd, dst, 1 << 20) > 0:
+                    pass
+                return
+            except (OSError, ValueError, io.UnsupportedOperation) as e:
+                logger.debug(f"splice недоступен, используется чтение блоками: {e}")
+        
+        # Запасной путь: копим вывод в 16 КБ буфере и сбрасываем не чаще раза в 200 мс
+        wrapper = None
+        try:
+            raw = io.FileIO(sys.stdout.fileno(), 'wb', closefd=False)
+            wrapper = sink = io.BufferedWriter(raw, buffer_size=1 << 14)
+            write = sink.write
+        except (OSError, ValueError, AttributeError, io.UnsupportedOperation):
+            buffer = getattr(sys.stdout, 'buffer', None)
+            if buffer is not None:
+                # Уже буферизованный поток не оборачиваем
+                sink = buffer
+                write = sink.write
+            else:
+                # У stdout нет ни дескриптора, ни байтового буфера (например, StringIO)
+                sink = sys.stdout
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                write = lambda chunk: sink.write(decoder.decode(chunk))
+        
+        self._progress_out = sink
+        last_flush = time.monotonic()
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                write(chunk)
+                
+                now = time.monotonic()
+                if now - last_flush >= 0.2:
+                    sink.flush()
+                    last_flush = now
+        finally:
+            self._progress_out = None
+            sink.flush()
+            if wrapper is not None:
+                # Отсоединяем обертку, чтобы при сборке мусора она не закрыла stdout
+                wrapper.detach()
     
-    def _finalize_backup(self, label: str, manifest_path: str, duration, size_estimate: str) -> None:
+    @staticmethod
+    def _elapsed(start_ns: int) -> timedelta:
+        """Длительность с момента start_ns по монотонным часам, с точностью до секунды"""
+        return timedelta(seconds=(time.monotonic_ns() - start_ns) // 1_000_000_000)
+    
+    def _finalize_backup(self, label: str, manifest_path: str, duration: timedelta, size_estimate: str) -> None:
         """Завершить бэкап и обновить реестр"""
         # Получение информации о лентах
         tapes = self.tape_driver.get_used_tapes()
@@ -200,13 +366,14 @@ class BackupEngine:
         file_number = self.tape_driver.get_file_number()
         
         # Форматирование длительности
-        duration_str = str(duration).split('.')[0]  # Убираем микросекунды
+        duration_str = str(duration)
         
         # Отправка уведомления о завершении
         self.bot.send_backup_completed(label, tapes, file_number, duration_str, size_estimate, clean_time)
         
         # Обновление реестра
         self.registry.add_backup(label, tapes, file_number, manifest_path)
+        self.registry.flush(fsync=True)
         
         print("\n" + "=" * 60)
         print(f"✅ Бэкап '{label}' успешно завершен")
@@ -220,7 +387,7 @@ class BackupEngine:
     
     def restore(self, destination_path: str, label: str) -> bool:
         """Восстановить данные из резервной копии"""
-        start_time = datetime.now()
+        start_ns = time.monotonic_ns()
         
         try:
             # Создание директории назначения
@@ -253,51 +420,56 @@ class BackupEngine:
             
             # Получение параметров для восстановления
             mbuffer_params = self.config.get_mbuffer_params()
-            block_size = mbuffer_params['block_size']
-            change_script = mbuffer_params['change_script']
+            block_size = mbuffer_params.block_size
+            change_script = mbuffer_params.change_script
             tape_dev = self.config.get('hardware', 'tape_dev')
             
             # Команда восстановления
-            restore_cmd = (
-                f"mbuffer -i {tape_dev} "
-                f"-m 1G -b {block_size} -n 0 "
-                f"-A '{change_script}' | "
-                f"tar -xvM --record-size={block_size} -f - -C {destination_path}"
-            )
+            mbuffer_cmd = [
+                "mbuffer", "-i", tape_dev,
+                "-m", "1G", "-b", block_size, "-n", "0",
+                "-A", change_script
+            ]
+            tar_cmd = [
+                "tar", "-xvM", f"--record-size={block_size}",
+                "-f", "-", "-C", destination_path
+            ]
             
             print(f"📥 Начало восстановления...")
             logger.info(f"Начало восстановления {label} в {destination_path}")
             
             # Выполнение восстановления
-            result = subprocess.run(
-                restore_cmd,
-                shell=True,
-                capture_output=True,
-                text=True
+            mbuffer_proc, tar_proc = self._start_pipeline(
+                mbuffer_cmd,
+                tar_cmd,
+                second_kwargs={
+                    'stdout': subprocess.PIPE,
+                    'stderr': subprocess.PIPE,
+                    'bufsize': 65536
+                }
             )
+            try:
+                # Читаем вывод tar потоково, не накапливая его в памяти
+                file_count, stderr = self._drain_restore_output(tar_proc)
+                tar_proc.wait()
+                mbuffer_proc.wait()
+            except BaseException:
+                # При прерывании не оставляем mbuffer и tar работать с приводом
+                self._stop_processes(mbuffer_proc, tar_proc)
+                raise
             
-            end_time = datetime.now()
-            duration = end_time - start_time
+            duration = self._elapsed(start_ns)
             
-            if result.returncode == 0:
-                # Подсчет восстановленных файлов
-                file_count = 0
-                try:
-                    # Простой подсчет по выводу tar
-                    file_count = len([line for line in result.stdout.split('\n') 
-                                    if line and not line.startswith('tar:')])
-                except:
-                    pass
-                
+            if tar_proc.returncode == 0:
                 print(f"✅ Восстановление '{label}' завершено")
                 print(f"📁 Назначение: {destination_path}")
-                print(f"⏱️  Длительность: {str(duration).split('.')[0]}")
+                print(f"⏱️  Длительность: {duration}")
                 
                 self.bot.send_restore_completed(label, destination_path, file_count)
                 logger.info(f"Восстановление {label} завершено успешно")
                 return True
             else:
-                error_msg = result.stderr[:200] if result.stderr else "Неизвестная ошибка"
+                error_msg = stderr[:200] if stderr else "Неизвестная ошибка"
                 print(f"❌ Ошибка восстановления")
                 print(f"stderr: {error_msg}")
                 
@@ -310,4 +482,40 @@ class BackupEngine:
             print(f"❌ Критическая ошибка при восстановлении: {error_msg}")
             self.bot.send_error(label, error_msg)
             logger.error(f"Критическая ошибка при восстановлении {label}: {error_msg}")
-            return False
\ No newline at end of file
+            return False
+    
+    def _drain_restore_output(self, proc: subprocess.Popen) -> Tuple[int, str]:
+        """Прочитать stdout/stderr tar до EOF: посчитать файлы и сохранить начало stderr"""
+        file_count = 0
+        # Первые байты незавершенной строки: достаточно для проверки префикса "tar:"
+        head = b""
+        stderr = bytearray()
+        
+        with selectors.DefaultSelector() as selector:
+            selector.register(proc.stdout, selectors.EVENT_READ, 'stdout')
+            selector.register(proc.stderr, selectors.EVENT_READ, 'stderr')
+            
+            while selector.get_map():
+                for key, _ in selector.select():
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    
+                    if key.data == 'stdout':
+                        # Простой подсчет по выводу tar: строка = файл, без разбиения на строки
+                        end = chunk.rfind(b"\n")
+                        if end < 0:
+                            head = (head + chunk)[:4]
+                            continue
+                        
+                        block = b"\n" + head + chunk[:end]
+                        file_count += block.count(b"\n") - block.count(b"\ntar:")
+                        head = chunk[end + 1:end + 5]
+                    elif len(stderr) < self.STDERR_KEEP_BYTES:
+                        stderr += chunk[:self.STDERR_KEEP_BYTES - len(stderr)]
+        
+        if head and not head.startswith(b"tar:"):
+            file_count += 1
+        
+        return file_count, stderr.decode('utf-8', errors='replace')
@@ -1,21 +1,61 @@
 import os
 import yaml
+import functools
 import logging
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 from datetime import datetime, timedelta
 
+# Используем C-реализацию libyaml, если PyYAML собран с ней
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+# Множители суффиксов размера: 'K', 'M', 'G', 'T'
+SIZE_MULTIPLIERS = {
+    'K': 1024,
+    'M': 1024 * 1024,
+    'G': 1024 * 1024 * 1024,
+    'T': 1024 * 1024 * 1024 * 1024
+}
+
+# Найденные пути конфигурации: (явный путь, рабочая директория) -> файл
+_resolved_config_paths: Dict[tuple, Path] = {}
+
+@dataclass(frozen=True)
+class MbufferParams:
+    """Параметры mbuffer, вычисленные при загрузке конфигурации"""
+    # __slots__ задаем явно: dataclass(slots=True) недоступен до Python 3.10
+    __slots__ = ('size', 'fill_percent', 'block_size', 'change_script', 'min_rate', 'max_rate')
+    
+    size: str
+    fill_percent: str
+    block_size: str
+    change_script: str
+    min_rate: str
+    max_rate: str
+
+
 class ConfigManager:
     """Менеджер конфигурации с поддержкой YAML"""
     
     def __init__(self, config_path: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
         self.config_path = self._resolve_config_path(config_path)
         self.config = self._load_config()
+        self._get_cache: Dict[tuple, Any] = {}
+        self._build_params()
         self._setup_logging()
-        self.logger = logging.getLogger(__name__)
     
     def _resolve_config_path(self, config_path: Optional[str]) -> Path:
         """Определить путь к конфигурационному файлу"""
+        cache_key = (config_path, os.getcwd())
+        cached_path = _resolved_config_paths.get(cache_key)
+        if cached_path is not None:
+            return cached_path
+        
         search_paths = []
         
         if config_path:
@@ -31,9 +71,16 @@ class ConfigManager:
         ])
         
         for path in search_paths:
-            if path.exists():
-                self.logger.info(f"Найден файл конфигурации: {path}")
-                return path.resolve()
+            # Один stat на кандидата, отсутствующие пути просто пропускаем
+            try:
+                os.stat(path)
+            except OSError:
+                continue
+            
+            self.logger.info(f"Найден файл конфигурации: {path}")
+            resolved_path = path.resolve()
+            _resolved_config_paths[cache_key] = resolved_path
+            return resolved_path
         
         # Если файл не найден, создаем в текущей директории
         default_path = Path.cwd() / "config.yaml"
@@ -143,15 +190,18 @@ class ConfigManager:
         
         config_path.parent.mkdir(parents=True, exist_ok=True)
         with open(config_path, 'w', encoding='utf-8') as f:
-            yaml.dump(default_config, f, default_flow_style=False, allow_unicode=True, indent=2)
+            yaml.dump(default_config, f, Dumper=SafeDumper, default_flow_style=False, allow_unicode=True, indent=2)
         
         self.logger.info(f"Создан файл конфигурации по умолчанию: {config_path}")
     
     def _load_config(self) -> Dict[str, Any]:
         """Загрузить конфигурацию из YAML файла"""
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
+            # Читаем файл целиком одним вызовом read() и декодируем один раз
+            with open(self.config_path, 'rb', buffering=65536) as f:
+                data = f.read().decode('utf-8')
+            
+            config = yaml.load(data, Loader=SafeLoader)
             
             if not config:
                 raise ValueError("Конфигурационный файл пуст")
@@ -172,12 +222,15 @@ class ConfigManager:
         
         log_level = getattr(logging, self.get('common', 'log_level', 'INFO').upper(), logging.INFO)
         
-        # Базовые настройки
-        logging.basicConfig(
-            level=log_level,
-            format=log_config.get('format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s'),
-            datefmt=log_config.get('date_format', '%Y-%m-%d %H:%M:%S')
-        )
+        root_logger = logging.getLogger()
+        
+        # Базовые настройки (только при первой инициализации)
+        if not root_logger.handlers:
+            logging.basicConfig(
+                level=log_level,
+                format=log_config.get('format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s'),
+                datefmt=log_config.get('date_format', '%Y-%m-%d %H:%M:%S')
+            )
         
         # Файловый обработчик
         log_file = log_config.get('file')
@@ -185,6 +238,12 @@ class ConfigManager:
             try:
                 from logging.handlers import RotatingFileHandler
                 
+                # Не добавляем повторно обработчик для того же файла
+                log_path = os.path.abspath(log_file)
+                if any(isinstance(h, RotatingFileHandler) and h.baseFilename == log_path
+                       for h in root_logger.handlers):
+                    return
+                
                 file_handler = RotatingFileHandler(
                     log_file,
                     maxBytes=self._parse_size(log_config.get('max_size', '100M')),
@@ -197,25 +256,20 @@ class ConfigManager:
                         datefmt=log_config.get('date_format', '%Y-%m-%d %H:%M:%S')
                     )
                 )
-                logging.getLogger().addHandler(file_handler)
+                root_logger.addHandler(file_handler)
                 self.logger.info(f"Логирование в файл: {log_file}")
             except Exception as e:
                 self.logger.error(f"Ошибка настройки файлового логирования: {e}")
     
-    def _parse_size(self, size_str: str) -> int:
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _parse_size(size_str: str) -> int:
         """Преобразовать строку размера в байты"""
         size_str = size_str.strip().upper()
         
-        multipliers = {
-            'K': 1024,
-            'M': 1024 * 1024,
-            'G': 1024 * 1024 * 1024,
-            'T': 1024 * 1024 * 1024 * 1024
-        }
-        
-        if size_str[-1] in multipliers:
+        multiplier = SIZE_MULTIPLIERS.get(size_str[-1])
+        if multiplier is not None:
             number = float(size_str[:-1])
-            multiplier = multipliers[size_str[-1]]
             return int(number * multiplier)
         else:
             return int(size_str)
@@ -239,22 +293,60 @@ class ConfigManager:
         else:
             return timedelta(seconds=int(time_str))
     
+    def _build_params(self) -> None:
+        """Предвычислить наборы параметров, которые читаются при каждом бэкапе"""
+        self._get_cache.clear()
+        self._tape_dev_stat_loaded = False
+        self._tape_dev_stat: Optional[os.stat_result] = None
+        
+        self._mbuffer_params = MbufferParams(
+            size=self.get('mbuffer', 'size', '2G'),
+            fill_percent=self.get('mbuffer', 'fill_percent', '90%'),
+            block_size=self.get('mbuffer', 'block_size', '256k'),
+            change_script=self.get('mbuffer', 'change_script', 'lto_backup change_tape'),
+            min_rate=self.get('mbuffer', 'min_rate', '100M'),
+            max_rate=self.get('mbuffer', 'max_rate', '150M')
+        )
+        
+        # Параметры бэкапа строятся при первом запросе: ошибка в max_file_size
+        # не должна мешать командам, которые бэкап не выполняют
+        self._backup_params: Optional[Dict[str, Any]] = None
+        
+        self._exclude_args = tuple(
+            f"--exclude={pattern}" for pattern in self.get('exclude', 'patterns', [])
+        )
+        
+        self._hardware_params = {
+            'has_robot': self.get('hardware', 'has_robot', False),
+            'robot_dev': self.get('hardware', 'robot_dev', '/dev/sg3'),
+            'tape_dev': self.get('hardware', 'tape_dev', '/dev/nst0'),
+            'err_threshold': self.get('hardware', 'err_threshold', 50),
+            'auto_rewind': self.get('hardware', 'auto_rewind', True)
+        }
+    
     def get(self, section: str, key: str, default: Any = None) -> Any:
         """Получить значение из конфигурации"""
+        cache_key = (section, key)
         try:
-            keys = [section] + key.split('.')
-            value = self.config
-            
-            for k in keys:
-                if isinstance(value, dict):
-                    value = value.get(k)
-                else:
-                    return default
-            
-            return value if value is not None else default
-            
-        except (KeyError, AttributeError):
-            return default
+            value = self._get_cache[cache_key]
+        except KeyError:
+            value = self._lookup(section, key)
+            self._get_cache[cache_key] = value
+        
+        return value if value is not None else default
+    
+    def _lookup(self, section: str, key: str) -> Any:
+        """Найти значение по пути section.key без подстановки значения по умолчанию"""
+        keys = [section] + key.split('.')
+        value = self.config
+        
+        for k in keys:
+            if isinstance(value, dict):
+                value = value.get(k)
+            else:
+                return None
+        
+        return value
     
     def get_section(self, section: str) -> Dict[str, Any]:
         """Получить всю секцию конфигурации"""
@@ -268,36 +360,42 @@ class ConfigManager:
         """Получить список паттернов для исключения"""
         return self.get('exclude', 'patterns', [])
     
-    def get_mbuffer_params(self) -> Dict[str, str]:
+    @property
+    def tape_dev_stat(self) -> Optional[os.stat_result]:
+        """Результат os.stat для устройства ленты (None, если его нет), вычисляется один раз"""
+        if not self._tape_dev_stat_loaded:
+            tape_dev = self.get('hardware', 'tape_dev')
+            try:
+                self._tape_dev_stat = os.stat(tape_dev) if tape_dev else None
+            except OSError:
+                self._tape_dev_stat = None
+            self._tape_dev_stat_loaded = True
+        
+        return self._tape_dev_stat
+    
+    def get_exclude_args(self) -> Tuple[str, ...]:
+        """Получить готовые аргументы --exclude для tar"""
+        return self._exclude_args
+    
+    def get_mbuffer_params(self) -> MbufferParams:
         """Получить параметры mbuffer"""
-        return {
-            'size': self.get('mbuffer', 'size', '2G'),
-            'fill_percent': self.get('mbuffer', 'fill_percent', '90%'),
-            'block_size': self.get('mbuffer', 'block_size', '256k'),
-            'change_script': self.get('mbuffer', 'change_script', 'lto_backup change_tape'),
-            'min_rate': self.get('mbuffer', 'min_rate', '100M'),
-            'max_rate': self.get('mbuffer', 'max_rate', '150M')
-        }
+        return self._mbuffer_params
     
     def get_backup_params(self) -> Dict[str, Any]:
         """Получить параметры бэкапа"""
-        return {
-            'compression': self.get('backup', 'compression', 'none'),
-            'verify_after_backup': self.get('backup', 'verify_after_backup', True),
-            'create_manifest': self.get('backup', 'create_manifest', True),
-            'max_file_size': self._parse_size(self.get('backup', 'max_file_size', '100G')),
-            'split_large_files': self.get('backup', 'split_large_files', True)
-        }
+        if self._backup_params is None:
+            self._backup_params = {
+                'compression': self.get('backup', 'compression', 'none'),
+                'verify_after_backup': self.get('backup', 'verify_after_backup', True),
+                'create_manifest': self.get('backup', 'create_manifest', True),
+                'max_file_size': self._parse_size(self.get('backup', 'max_file_size', '100G')),
+                'split_large_files': self.get('backup', 'split_large_files', True)
+            }
+        return self._backup_params
     
     def get_hardware_params(self) -> Dict[str, Any]:
         """Получить параметры оборудования"""
-        return {
-            'has_robot': self.get('hardware', 'has_robot', False),
-            'robot_dev': self.get('hardware', 'robot_dev', '/dev/sg3'),
-            'tape_dev': self.get('hardware', 'tape_dev', '/dev/nst0'),
-            'err_threshold': self.get('hardware', 'err_threshold', 50),
-            'auto_rewind': self.get('hardware', 'auto_rewind', True)
-        }
+        return self._hardware_params
     
     def get_scheduling_params(self) -> Dict[str, Any]:
         """Получить параметры планировщика"""
@@ -317,7 +415,7 @@ class ConfigManager:
         config_dir.mkdir(parents=True, exist_ok=True)
         
         with open(self.config_path, 'w', encoding='utf-8') as f:
-            yaml.dump(self.config, f, default_flow_style=False, allow_unicode=True, indent=2)
+            yaml.dump(self.config, f, Dumper=SafeDumper, default_flow_style=False, allow_unicode=True, indent=2)
         
         self.logger.info(f"Конфигурация сохранена в {self.config_path}")
     
@@ -332,6 +430,7 @@ class ConfigManager:
             config = config[k]
         
         config[keys[-1]] = value
+        self._build_params()
     
     def validate(self) -> List[str]:
         """Проверить валидность конфигурации"""
@@ -360,7 +459,7 @@ class ConfigManager:
         
         # Проверка существования устройства ленты
         tape_dev = self.get('hardware', 'tape_dev')
-        if tape_dev and not Path(tape_dev).exists():
+        if tape_dev and self.tape_dev_stat is None:
             errors.append(f"Устройство ленты не найдено: {tape_dev}")
         
         # Проверка правильности размера буфера
@@ -1,183 +1,451 @@
 import csv
 import os
+import re
 import json
+import atexit
 import logging
-from datetime import datetime
+import threading
+import weakref
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# Колонки CSV реестра. Реестр ведется как журнал: op = ADD добавляет запись,
+# op = DEL удаляет все предыдущие записи с той же меткой (до компактизации)
+REGISTRY_FIELDS = (
+    'timestamp', 'label', 'tapes',
+    'file_number', 'manifest_path', 'size_estimate', 'op'
+)
+
+# Позиции колонок в строке CSV
+COL_TIMESTAMP, COL_LABEL, COL_TAPES, COL_FILE_NUMBER, COL_MANIFEST, COL_SIZE, COL_OP = range(7)
+
+OP_ADD = 'ADD'
+OP_DEL = 'DEL'
+
+# Начало метки времени в формате isoformat(); только такие метки
+# можно сравнивать со сроком хранения как строки
+_ISO_TIMESTAMP_RE = re.compile(r'\d{4}-\d{2}-\d{2}T')
+
+# Живые экземпляры RegistryManager: при выходе их отложенные записи
+# сбрасываются одним обработчиком atexit, не удерживающим объекты
+_live_managers = weakref.WeakSet()
+
+def _flush_all_at_exit() -> None:
+    """Сбросить накопленные записи всех живых реестров"""
+    for manager in list(_live_managers):
+        try:
+            manager.flush()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить реестр при выходе: {e}")
+
+atexit.register(_flush_all_at_exit)
+
 class RegistryManager:
     """Менеджер реестра бэкапов"""
     
+    # Сброс накопленных записей: по количеству строк или по истечении задержки
+    FLUSH_MAX_ROWS = 64
+    FLUSH_DELAY = 5.0
+    
     def __init__(self, config):
         self.config = config
         self.registry_file = config.get('common', 'registry_csv')
         self.stats_file = Path(self.registry_file).with_suffix('.json')
+        
+        # Разобранные строки реестра (списки по колонкам COL_*) и
+        # (mtime_ns, size) файла, из которого они прочитаны
+        self._rows: Optional[List[List[str]]] = None
+        self._rows_key: Optional[tuple] = None
+        # Индекс метка -> первая запись с этой меткой
+        self._by_label: Dict[str, List[str]] = {}
+        
+        # Записи и статистика, еще не записанные на диск
+        self._pending_rows: List[List[str]] = []
+        self._stats_dirty = False
+        self._flush_lock = threading.RLock()
+        self._flush_timer: Optional[threading.Timer] = None
+        
         self._ensure_registry_exists()
         self._load_stats()
+        _live_managers.add(self)
     
     def _ensure_registry_exists(self):
         """Убедиться, что файл реестра существует"""
-        if not os.path.exists(self.registry_file):
-            Path(self.registry_file).parent.mkdir(parents=True, exist_ok=True)
-            with open(self.registry_file, 'w', newline='') as f:
+        Path(self.registry_file).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Режим 'x' создает файл только если его еще нет, без отдельной проверки
+            with open(self.registry_file, 'x', newline='') as f:
                 writer = csv.writer(f, delimiter=';')
-                writer.writerow([
-                    'timestamp', 'label', 'tapes', 
-                    'file_number', 'manifest_path', 'size_estimate'
-                ])
-            logger.info(f"Создан новый реестр: {self.registry_file}")
+                writer.writerow(REGISTRY_FIELDS)
+        except FileExistsError:
+            self._migrate_header()
+            return
+        logger.info(f"Создан новый реестр: {self.registry_file}")
+    
+    def _migrate_header(self) -> None:
+        """Перевести реестр старого формата (без колонки op) на текущий заголовок
+        
+        Файл переписывается один раз через временный файл и os.replace:
+        строкам без op добавляется ADD, чтобы колонки совпадали с заголовком.
+        """
+        with open(self.registry_file, 'r', newline='') as f:
+            header = next(csv.reader(f, delimiter=';'), None)
+        
+        if header != list(REGISTRY_FIELDS[:COL_OP]):
+            return
+        
+        width = len(REGISTRY_FIELDS)
+        tmp_file = f"{self.registry_file}.tmp.{os.getpid()}"
+        with open(self.registry_file, 'r', newline='') as src, \
+                open(tmp_file, 'w', newline='') as dst:
+            reader = csv.reader(src, delimiter=';')
+            writer = csv.writer(dst, delimiter=';')
+            next(reader, None)
+            writer.writerow(REGISTRY_FIELDS)
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) < width:
+                    row.extend([''] * (width - len(row)))
+                if not row[COL_OP]:
+                    row[COL_OP] = OP_ADD
+                writer.writerow(row)
+        os.replace(tmp_file, self.registry_file)
+        
+        logger.info(f"Заголовок реестра обновлен до нового формата: {self.registry_file}")
     
     def _load_stats(self):
         """Загрузить статистику"""
-        if self.stats_file.exists():
-            try:
-                with open(self.stats_file, 'r') as f:
-                    self.stats = json.load(f)
-            except:
-                self.stats = {}
-        else:
+        try:
+            with open(self.stats_file, 'r') as f:
+                self.stats = json.load(f)
+        except (OSError, ValueError):
+            # Нет файла или он поврежден
             self.stats = {}
     
     def _save_stats(self):
-        """Сохранить статистику"""
-        with open(self.stats_file, 'w') as f:
-            json.dump(self.stats, f, indent=2)
+        """Сохранить статистику
+        
+        JSON сериализуется одним вызовом и пишется во временный файл,
+        который атомарно заменяет прежний: при сбое остается старая версия.
+        """
+        data = json.dumps(self.stats, separators=(',', ':'))
+        # Имя с PID: планировщик и CLI могут сохранять статистику одновременно
+        tmp_file = f"{self.stats_file}.tmp.{os.getpid()}"
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+        os.replace(tmp_file, self.stats_file)
+    
+    def _read_rows(self) -> List[List[str]]:
+        """Прочитать реестр, повторно используя разобранные строки, пока файл не изменился"""
+        # Под блокировкой: таймер flush() дописывает строки в тот же кэш
+        with self._flush_lock:
+            self.flush()
+            
+            try:
+                st = os.stat(self.registry_file)
+            except FileNotFoundError:
+                self._invalidate_rows()
+                return []
+            
+            key = (st.st_mtime_ns, st.st_size)
+            if self._rows is None or self._rows_key != key:
+                self._rows = self._fold_log(self._read_log())
+                self._rows_key = key
+                
+                self._by_label = {}
+                for row in self._rows:
+                    self._by_label.setdefault(row[COL_LABEL], row)
+            
+            return self._rows
+    
+    def _read_log(self) -> List[List[str]]:
+        """Прочитать все строки журнала реестра, включая метки удаления"""
+        width = len(REGISTRY_FIELDS)
+        rows = []
+        
+        with open(self.registry_file, 'r', newline='') as f:
+            reader = csv.reader(f, delimiter=';')
+            next(reader, None)
+            for row in reader:
+                if not row:
+                    continue
+                # В реестрах старого формата нет колонки op
+                if len(row) < width:
+                    row.extend([''] * (width - len(row)))
+                if not row[COL_OP]:
+                    row[COL_OP] = OP_ADD
+                rows.append(row)
+        
+        return rows
+    
+    @staticmethod
+    def _fold_log(log_rows: List[List[str]]) -> List[List[str]]:
+        """Применить метки удаления: оставить только живые записи"""
+        last_delete = {}
+        for i, row in enumerate(log_rows):
+            if row[COL_OP] == OP_DEL:
+                last_delete[row[COL_LABEL]] = i
+        
+        if not last_delete:
+            return log_rows
+        
+        return [
+            row for i, row in enumerate(log_rows)
+            if row[COL_OP] != OP_DEL and i > last_delete.get(row[COL_LABEL], -1)
+        ]
+    
+    @staticmethod
+    def _row_dict(row: List[str]) -> Dict[str, str]:
+        """Представить строку реестра словарем для внешних вызывающих"""
+        return dict(zip(REGISTRY_FIELDS, row))
+    
+    def _rows_cache_valid(self) -> bool:
+        """Проверить, что кэш строк соответствует текущему файлу реестра"""
+        if self._rows is None:
+            return False
+        try:
+            st = os.stat(self.registry_file)
+        except FileNotFoundError:
+            return False
+        return self._rows_key == (st.st_mtime_ns, st.st_size)
+    
+    def _invalidate_rows(self) -> None:
+        """Сбросить кэш строк после изменения файла реестра"""
+        self._rows = None
+        self._rows_key = None
+        self._by_label = {}
     
     def add_backup(self, label: str, tapes: str, file_number: str, 
                   manifest_path: str, size_estimate: str = "") -> None:
-        """Добавить запись о бэкапе в реестр"""
+        """Добавить запись о бэкапе в реестр
+        
+        Запись попадает на диск при следующем flush(): автоматически по
+        накоплении FLUSH_MAX_ROWS строк, через FLUSH_DELAY секунд или при выходе.
+        """
         timestamp = datetime.now().isoformat()
         
-        with open(self.registry_file, 'a', newline='') as f:
-            writer = csv.writer(f, delimiter=';')
-            writer.writerow([
+        with self._flush_lock:
+            self._pending_rows.append([
                 timestamp,
                 label,
                 tapes,
                 file_number,
                 manifest_path,
-                size_estimate
+                size_estimate,
+                OP_ADD
             ])
+            
+            # Обновляем статистику
+            self.stats['total_backups'] = self.stats.get('total_backups', 0) + 1
+            self.stats['last_backup'] = timestamp
+            self.stats['last_backup_label'] = label
+            
+            # Увеличиваем счетчик лент (get_used_tapes разделяет метки одним пробелом)
+            if tapes and tapes != "N/A":
+                self.stats['total_tapes_used'] = self.stats.get('total_tapes_used', 0) + tapes.count(' ') + 1
+            
+            self._stats_dirty = True
+            
+            if len(self._pending_rows) >= self.FLUSH_MAX_ROWS:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.FLUSH_DELAY, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
         
-        # Обновляем статистику
-        self.stats['total_backups'] = self.stats.get('total_backups', 0) + 1
-        self.stats['last_backup'] = timestamp
-        self.stats['last_backup_label'] = label
-        
-        # Увеличиваем счетчик лент
-        if tapes != "N/A":
-            tape_list = tapes.split()
-            self.stats['total_tapes_used'] = self.stats.get('total_tapes_used', 0) + len(tape_list)
-        
-        self._save_stats()
         logger.info(f"Добавлен бэкап в реестр: {label}")
     
+    def flush(self, fsync: bool = False) -> None:
+        """Записать накопленные записи одним вызовом и сохранить статистику"""
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            
+            if self._pending_rows:
+                cache_valid = self._rows_cache_valid()
+                
+                with open(self.registry_file, 'a', newline='', buffering=1 << 20) as f:
+                    writer = csv.writer(f, delimiter=';')
+                    writer.writerows(self._pending_rows)
+                    if fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                
+                has_deletes = any(row[COL_OP] == OP_DEL for row in self._pending_rows)
+                
+                if cache_valid and not has_deletes:
+                    # Дописываем новые строки в кэш и индекс вместо полного перечитывания
+                    for row in self._pending_rows:
+                        self._rows.append(row)
+                        self._by_label.setdefault(row[COL_LABEL], row)
+                    st = os.stat(self.registry_file)
+                    self._rows_key = (st.st_mtime_ns, st.st_size)
+                else:
+                    self._invalidate_rows()
+                
+                self._pending_rows = []
+            
+            if self._stats_dirty:
+                self._save_stats()
+                self._stats_dirty = False
+    
     def find_backup(self, label: str) -> Optional[Dict[str, str]]:
         """Найти информацию о бэкапе по метке"""
-        if not os.path.exists(self.registry_file):
-            return None
-        
-        with open(self.registry_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter=';')
-            for row in reader:
-                if row['label'] == label:
-                    return row
-        
-        return None
+        self._read_rows()
+        row = self._by_label.get(label)
+        return self._row_dict(row) if row is not None else None
     
     def list_backups(self) -> List[Dict[str, str]]:
         """Получить список всех бэкапов"""
-        if not os.path.exists(self.registry_file):
-            return []
-        
-        backups = []
-        with open(self.registry_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter=';')
-            for row in reader:
-                backups.append(row)
-        
-        return backups
+        return [self._row_dict(row) for row in self._read_rows()]
     
     def delete_backup(self, label: str) -> bool:
-        """Удалить запись о бэкапе из реестра"""
-        if not os.path.exists(self.registry_file):
-            return False
-        
-        # Читаем все записи кроме удаляемой
-        backups = []
-        deleted = False
-        
-        with open(self.registry_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter=';')
-            fieldnames = reader.fieldnames
-            
-            for row in reader:
-                if row['label'] != label:
-                    backups.append(row)
-                else:
-                    deleted = True
+        """Удалить запись о бэкапе из реестра
         
-        # Если ничего не удалили, возвращаем False
-        if not deleted:
+        Файл не переписывается: в журнал дописывается метка удаления,
+        физически записи убираются при compact().
+        """
+        if self.find_backup(label) is None:
             return False
         
-        # Перезаписываем файл
-        with open(self.registry_file, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=';')
-            writer.writeheader()
-            writer.writerows(backups)
+        with self._flush_lock:
+            self._pending_rows.append([
+                datetime.now().isoformat(), label, '', '', '', '', OP_DEL
+            ])
+            self.flush()
         
         logger.info(f"Удален бэкап из реестра: {label}")
         return True
     
     def get_backup_stats(self) -> Dict[str, Any]:
         """Получить статистику бэкапов"""
-        backups = self.list_backups()
+        oldest = newest = None
+        labels = set()
+        count = 0
+        
+        # Один проход по кэшированным строкам без копирования списка
+        for row in self._read_rows():
+            timestamp = row[COL_TIMESTAMP]
+            if oldest is None or timestamp < oldest:
+                oldest = timestamp
+            if newest is None or timestamp > newest:
+                newest = timestamp
+            labels.add(row[COL_LABEL])
+            count += 1
         
         return {
-            'total_backups': len(backups),
-            'oldest_backup': min(backups, key=lambda x: x['timestamp'])['timestamp'] if backups else None,
-            'newest_backup': max(backups, key=lambda x: x['timestamp'])['timestamp'] if backups else None,
-            'unique_labels': len(set(b['label'] for b in backups)),
+            'total_backups': count,
+            'oldest_backup': oldest,
+            'newest_backup': newest,
+            'unique_labels': len(labels),
             'tapes_used': self.stats.get('total_tapes_used', 0)
         }
     
-    def cleanup_old_backups(self, retention_days: int = 90) -> int:
-        """Очистить старые записи из реестра"""
-        if retention_days <= 0:
+    def compact(self, retention_days: int = 0) -> int:
+        """Переписать реестр без удаленных записей
+        
+        Если retention_days > 0, также убираются записи старше этого срока.
+        Файл обрабатывается потоково во временный файл, который затем
+        атомарно заменяет реестр. Возвращает количество записей, удаленных
+        по сроку хранения.
+        """
+        # Файл читается и заменяется целиком: никаких дозаписей в это время
+        with self._flush_lock:
+            return self._compact_locked(retention_days)
+    
+    def _compact_locked(self, retention_days: int) -> int:
+        """Тело compact(); вызывается под _flush_lock"""
+        self.flush()
+        
+        # Метки времени записаны через isoformat() и сравниваются как строки
+        cutoff_iso = None
+        if retention_days > 0:
+            cutoff_iso = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        
+        try:
+            # Состояние файла до чтения: по нему видно, дописал ли в реестр
+            # другой процесс, пока строился новый файл
+            st = os.stat(self.registry_file)
+            source_key = (st.st_mtime_ns, st.st_size)
+            
+            # Первый проход: позиции последних меток удаления для каждой метки
+            last_delete = {}
+            with open(self.registry_file, 'r', newline='') as f:
+                reader = csv.reader(f, delimiter=';')
+                next(reader, None)
+                for i, row in enumerate(reader):
+                    if len(row) > COL_OP and row[COL_OP] == OP_DEL:
+                        last_delete[row[COL_LABEL]] = i
+        except FileNotFoundError:
             return 0
         
-        if not os.path.exists(self.registry_file):
+        if not last_delete and cutoff_iso is None:
             return 0
         
-        cutoff_date = datetime.now() - timedelta(days=retention_days)
-        kept_backups = []
+        # Второй проход: переносим живые записи во временный файл
+        tmp_file = f"{self.registry_file}.tmp.{os.getpid()}"
         deleted_count = 0
+        removed_count = 0
         
-        with open(self.registry_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter=';')
-            fieldnames = reader.fieldnames
+        with open(self.registry_file, 'r', newline='') as src, \
+                open(tmp_file, 'w', newline='') as dst:
+            reader = csv.reader(src, delimiter=';')
+            writer = csv.writer(dst, delimiter=';')
+            next(reader, None)
+            writer.writerow(REGISTRY_FIELDS)
             
-            for row in reader:
-                try:
-                    backup_date = datetime.fromisoformat(row['timestamp'])
-                    if backup_date >= cutoff_date:
-                        kept_backups.append(row)
-                    else:
-                        deleted_count += 1
-                except:
-                    kept_backups.append(row)
-        
-        # Перезаписываем файл
-        with open(self.registry_file, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=';')
-            writer.writeheader()
-            writer.writerows(kept_backups)
+            for i, row in enumerate(reader):
+                if len(row) <= COL_LABEL:
+                    # Пустые строки не переносим
+                    continue
+                if len(row) > COL_OP and row[COL_OP] == OP_DEL:
+                    removed_count += 1
+                    continue
+                if i <= last_delete.get(row[COL_LABEL], -1):
+                    removed_count += 1
+                    continue
+                
+                # Записи с пустой или неразборчивой датой (правка вручную) сохраняются
+                if (cutoff_iso is not None
+                        and _ISO_TIMESTAMP_RE.match(row[COL_TIMESTAMP])
+                        and row[COL_TIMESTAMP] < cutoff_iso):
+                    deleted_count += 1
+                    continue
+                
+                if len(row) <= COL_OP:
+                    row.append(OP_ADD)
+                writer.writerow(row)
+        
+        if deleted_count == 0 and removed_count == 0:
+            os.unlink(tmp_file)
+            return 0
+        
+        st = os.stat(self.registry_file)
+        if (st.st_mtime_ns, st.st_size) != source_key:
+            # Замена потеряла бы строки, дописанные другим процессом
+            os.unlink(tmp_file)
+            logger.warning("Реестр изменен другим процессом во время компактизации, "
+                           "компактизация отложена")
+            return 0
+        
+        os.replace(tmp_file, self.registry_file)
+        self._invalidate_rows()
+        
+        return deleted_count
+    
+    def cleanup_old_backups(self, retention_days: int = 90) -> int:
+        """Очистить старые записи из реестра"""
+        if retention_days <= 0:
+            return 0
+        
+        deleted_count = self.compact(retention_days)
         
         if deleted_count > 0:
             logger.info(f"Удалено {deleted_count} старых записей из реестра")
         
-        return deleted_count
\ No newline at end of file
+        return deleted_count
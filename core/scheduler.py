@@ -3,22 +3,83 @@
 Scheduler module for automatic backup scheduling
 """
 
-import schedule
+import calendar
+import functools
+import hashlib
+import heapq
+import tempfile
 import time
 import logging
+import os
+import stat
 import threading
-from datetime import datetime
-from typing import Dict, Any, Optional
+from datetime import date, datetime, time as time_of_day, timedelta
+from typing import Dict, Any, Optional, Callable, List, Tuple
 from pathlib import Path
 
 from core.config_manager import ConfigManager
 from core.backup_engine import BackupEngine
-from core.registry_manager import RegistryManager
-from hardware.tape_driver import TapeDriver
-from notification.telegram_bot import TelegramBot
 
 logger = logging.getLogger(__name__)
 
+# Day name -> datetime.weekday() index
+_WEEKDAYS = {
+    'monday': 0,
+    'tuesday': 1,
+    'wednesday': 2,
+    'thursday': 3,
+    'friday': 4,
+    'saturday': 5,
+    'sunday': 6
+}
+
+# Candidate directories for path list files handed to the backup engine,
+# tried in order; each must be a private (0700) directory owned by us
+PATH_LIST_DIRS = (
+    Path("/var/cache/lto-backup"),
+    Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / ".cache") / "lto_backup",
+)
+
+# Longest single wait, so wall clock adjustments are picked up
+MAX_WAIT_SECONDS = 3600
+
+
+def _next_daily(hour: int, minute: int, now: datetime) -> datetime:
+    """Next occurrence of hour:minute after now"""
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def _next_weekly(weekday: int, hour: int, minute: int, now: datetime) -> datetime:
+    """Next occurrence of weekday at hour:minute after now"""
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    candidate += timedelta(days=(weekday - now.weekday()) % 7)
+    if candidate <= now:
+        candidate += timedelta(days=7)
+    return candidate
+
+
+def _next_monthly(day: int, hour: int, minute: int, now: datetime) -> datetime:
+    """Next occurrence of day-of-month at hour:minute after now (months without that day are skipped)"""
+    # Raises ValueError for an invalid time instead of searching forever
+    at = time_of_day(hour, minute)
+    if not 1 <= day <= 31:
+        raise ValueError(f"day is out of range for month: {day}")
+    
+    year, month = now.year, now.month
+    while True:
+        if day <= calendar.monthrange(year, month)[1]:
+            candidate = datetime.combine(date(year, month, day), at)
+            if candidate > now:
+                return candidate
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
+
+
 class BackupScheduler:
     """Scheduler for automatic backup operations"""
     
@@ -27,16 +88,24 @@ class BackupScheduler:
         self.scheduling_enabled = config.get('scheduling', 'enabled', False)
         self.schedule_params = config.get_scheduling_params()
         
-        # Initialize components
+        # Initialize components; the engine's instances are shared so the
+        # registry and drive state are loaded once
         self.backup_engine = BackupEngine(config)
-        self.registry = RegistryManager(config)
-        self.tape_driver = TapeDriver(config)
-        self.bot = TelegramBot(config)
+        self.registry = self.backup_engine.registry
+        self.tape_driver = self.backup_engine.tape_driver
+        self.bot = self.backup_engine.bot
         
         # Scheduler state
         self.scheduler_thread = None
         self.running = False
-        self.jobs = {}
+        # tag -> function computing the next run after a given datetime
+        self.jobs: Dict[str, Callable[[datetime], datetime]] = {}
+        # Heap of (next_run_timestamp, tag, job) ordered by due time
+        self._heap: List[Tuple[float, str, Callable[[], Any]]] = []
+        # ((important_dirs, excluded_dirs), configured paths minus exclusions)
+        self._paths_cache: Optional[Tuple[tuple, List[str]]] = None
+        # Set by stop() to wake the scheduler loop immediately
+        self._stop_event = threading.Event()
         
         logger.info("Backup scheduler initialized")
     
@@ -56,16 +125,67 @@ class BackupScheduler:
     def _get_backup_paths(self) -> list:
         """Get paths to backup from configuration"""
         paths_config = self.config.get_section('paths')
-        important_dirs = paths_config.get('important_dirs', [])
-        excluded_dirs = paths_config.get('excluded_dirs', [])
+        important_dirs = tuple(paths_config.get('important_dirs', []))
+        excluded_dirs = tuple(paths_config.get('excluded_dirs', []))
+        key = (important_dirs, excluded_dirs)
         
-        # Filter out excluded directories
-        backup_paths = []
-        for path in important_dirs:
-            if path not in excluded_dirs and Path(path).exists():
-                backup_paths.append(path)
+        # Keyed on the in-memory values, so config.update() is picked up
+        if self._paths_cache is None or self._paths_cache[0] != key:
+            # Filter out excluded directories
+            excluded = set(excluded_dirs)
+            candidates = [path for path in important_dirs if path not in excluded]
+            self._paths_cache = (key, candidates)
+        
+        # Existence is checked on every run: directories may come and go
+        return [path for path in self._paths_cache[1] if Path(path).exists()]
+    
+    @staticmethod
+    def _private_dir() -> Path:
+        """Return the first usable PATH_LIST_DIRS entry, created 0700 and owned by us"""
+        for directory in PATH_LIST_DIRS:
+            try:
+                directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+                st = os.lstat(directory)
+            except OSError:
+                continue
+            if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid():
+                logger.warning("Ignoring %s: not a directory owned by the current user", directory)
+                continue
+            if st.st_mode & 0o077:
+                os.chmod(directory, 0o700)
+            return directory
         
-        return backup_paths
+        raise OSError("No private directory available for backup path lists")
+    
+    @classmethod
+    def _get_path_list_file(cls, backup_paths: List[str]) -> str:
+        """Return a file listing backup_paths, reused while its contents still match"""
+        content = "".join(f"{path}\n" for path in backup_paths).encode('utf-8')
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        directory = cls._private_dir()
+        list_file = directory / f"pathlist-{digest}.txt"
+        
+        try:
+            if list_file.read_bytes() == content:
+                return str(list_file)
+        except OSError:
+            pass
+        
+        # Write under a unique name first so a concurrent job never sees a partial list
+        fd, tmp_name = tempfile.mkstemp(dir=str(directory), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_name, list_file)
+        
+        # Lists for path sets no longer configured are dropped
+        for stale in directory.glob("pathlist-*.txt"):
+            if stale != list_file:
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass
+        
+        return str(list_file)
     
     def _run_backup_job(self, backup_type: str) -> bool:
         """Execute backup job"""
@@ -82,40 +202,25 @@ class BackupScheduler:
             # Create backup label
             label = self._create_backup_label(backup_type)
             
-            # Create temporary directory for backup list
-            import tempfile
-            import os
+            # Execute backup using the list file
+            list_file = self._get_path_list_file(backup_paths)
+            success = self.backup_engine.backup(f"@{list_file}", label)
             
-            # Create file with list of directories to backup
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-                for path in backup_paths:
-                    f.write(f"{path}\n")
-                list_file = f.name
+            if success:
+                logger.info(f"Scheduled {backup_type} backup completed: {label}")
+                self.bot.send_message(
+                    f"✅ Автоматический {backup_type} бэкап завершен: `{label}`",
+                    "INFO"
+                )
+            else:
+                logger.error(f"Scheduled {backup_type} backup failed: {label}")
+                self.bot.send_message(
+                    f"❌ Автоматический {backup_type} бэкап не удался: `{label}`",
+                    "ERROR"
+                )
+            
+            return success
             
-            try:
-                # Execute backup using the list file
-                success = self.backup_engine.backup(f"@{list_file}", label)
-                
-                if success:
-                    logger.info(f"Scheduled {backup_type} backup completed: {label}")
-                    self.bot.send_message(
-                        f"✅ Автоматический {backup_type} бэкап завершен: `{label}`",
-                        "INFO"
-                    )
-                else:
-                    logger.error(f"Scheduled {backup_type} backup failed: {label}")
-                    self.bot.send_message(
-                        f"❌ Автоматический {backup_type} бэкап не удался: `{label}`",
-                        "ERROR"
-                    )
-                
-                return success
-                
-            finally:
-                # Clean up temporary file
-                if os.path.exists(list_file):
-                    os.unlink(list_file)
-                    
         except Exception as e:
             logger.error(f"Error in scheduled backup job: {e}")
             self.bot.send_message(
@@ -124,6 +229,12 @@ class BackupScheduler:
             )
             return False
     
+    def _add_job(self, tag: str, next_run: Callable[[datetime], datetime],
+                 job: Callable[[], Any]) -> None:
+        """Register job and push its first run onto the heap"""
+        self.jobs[tag] = next_run
+        heapq.heappush(self._heap, (next_run(datetime.now()).timestamp(), tag, job))
+    
     def _setup_daily_backup(self) -> None:
         """Setup daily backup schedule"""
         daily_time = self.schedule_params.get('daily_at', '02:00')
@@ -133,9 +244,11 @@ class BackupScheduler:
             hour, minute = map(int, daily_time.split(':'))
             
             # Schedule daily job
-            schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(
-                self._run_backup_job, 'daily'
-            ).tag('daily')
+            self._add_job(
+                'daily',
+                lambda now: _next_daily(hour, minute, now),
+                functools.partial(self._run_backup_job, 'daily')
+            )
             
             logger.info(f"Daily backup scheduled at {daily_time}")
             
@@ -151,21 +264,13 @@ class BackupScheduler:
             # Parse time
             hour, minute = map(int, daily_time.split(':'))
             
-            # Map day names
-            day_map = {
-                'monday': schedule.every().monday,
-                'tuesday': schedule.every().tuesday,
-                'wednesday': schedule.every().wednesday,
-                'thursday': schedule.every().thursday,
-                'friday': schedule.every().friday,
-                'saturday': schedule.every().saturday,
-                'sunday': schedule.every().sunday
-            }
-            
-            if weekly_day in day_map:
-                day_map[weekly_day].at(f"{hour:02d}:{minute:02d}").do(
-                    self._run_backup_job, 'weekly'
-                ).tag('weekly')
+            if weekly_day in _WEEKDAYS:
+                weekday = _WEEKDAYS[weekly_day]
+                self._add_job(
+                    'weekly',
+                    lambda now: _next_weekly(weekday, hour, minute, now),
+                    functools.partial(self._run_backup_job, 'weekly')
+                )
                 logger.info(f"Weekly backup scheduled on {weekly_day} at {daily_time}")
             else:
                 logger.warning(f"Invalid weekly day: {weekly_day}")
@@ -182,13 +287,15 @@ class BackupScheduler:
             # Parse time
             hour, minute = map(int, daily_time.split(':'))
             
-            # Schedule monthly job (simplified - runs on specific day of month)
-            def monthly_job():
-                today = datetime.now().day
-                if today == monthly_day:
-                    self._run_backup_job('monthly')
+            if not 1 <= monthly_day <= 31:
+                logger.warning(f"Invalid monthly day: {monthly_day}")
+                return
             
-            schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(monthly_job).tag('monthly')
+            self._add_job(
+                'monthly',
+                lambda now: _next_monthly(monthly_day, hour, minute, now),
+                functools.partial(self._run_backup_job, 'monthly')
+            )
             logger.info(f"Monthly backup scheduled on day {monthly_day} at {daily_time}")
             
         except Exception as e:
@@ -205,6 +312,9 @@ class BackupScheduler:
                 deleted = self.registry.cleanup_old_backups(retention_days)
                 if deleted > 0:
                     logger.info(f"Cleaned up {deleted} old backup records")
+            else:
+                # Only drop deleted records from the registry log
+                self.registry.compact()
             
             # Apply retention policy if configured
             if retention_policy:
@@ -223,7 +333,7 @@ class BackupScheduler:
         self._setup_monthly_backup()
         
         # Schedule cleanup job (runs daily)
-        schedule.every().day.at("03:00").do(self._cleanup_old_backups).tag('cleanup')
+        self._add_job('cleanup', lambda now: _next_daily(3, 0, now), self._cleanup_old_backups)
         
         # Send startup notification
         self.bot.send_message("🔄 Планировщик бэкапов запущен", "INFO")
@@ -231,13 +341,29 @@ class BackupScheduler:
         # Main scheduler loop
         while self.running:
             try:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
+                if not self._heap:
+                    self._stop_event.wait(MAX_WAIT_SECONDS)
+                    continue
+                
+                # Sleep until the earliest job is due
+                next_ts, tag, job = self._heap[0]
+                delay = next_ts - time.time()
+                if delay > 0:
+                    self._stop_event.wait(min(delay, MAX_WAIT_SECONDS))
+                    continue
+                
+                heapq.heappop(self._heap)
+                try:
+                    job()
+                finally:
+                    # Reschedule from the job's end time; runs missed meanwhile are skipped
+                    next_run = self.jobs[tag](datetime.now())
+                    heapq.heappush(self._heap, (next_run.timestamp(), tag, job))
             except KeyboardInterrupt:
                 break
             except Exception as e:
                 logger.error(f"Error in scheduler loop: {e}")
-                time.sleep(300)  # Wait 5 minutes on error
+                self._stop_event.wait(300)  # Wait 5 minutes on error
         
         logger.info("Scheduler loop stopped")
     
@@ -262,6 +388,7 @@ class BackupScheduler:
             return False
         
         self.running = True
+        self._stop_event.clear()
         self.scheduler_thread = threading.Thread(
             target=self._scheduler_loop,
             name="BackupScheduler",
@@ -275,12 +402,14 @@ class BackupScheduler:
     def stop(self) -> None:
         """Stop the backup scheduler"""
         self.running = False
+        self._stop_event.set()
         
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=30)
         
         # Clear all scheduled jobs
-        schedule.clear()
+        self._heap.clear()
+        self.jobs.clear()
         
         logger.info("Backup scheduler stopped")
         self.bot.send_message("⏹️ Планировщик бэкапов остановлен", "INFO")
@@ -297,18 +426,17 @@ class BackupScheduler:
             return job_info
         
         # Get information about scheduled jobs
-        jobs = schedule.get_jobs()
-        for job in jobs:
+        jobs = sorted(self._heap)
+        for next_ts, tag, job in jobs:
             job_info['jobs'].append({
-                'function': job.job_func.__name__ if hasattr(job.job_func, '__name__') else str(job.job_func),
-                'tags': list(job.tags),
-                'next_run': str(job.next_run) if job.next_run else None
+                'function': getattr(job, 'func', job).__name__,
+                'tags': [tag],
+                'next_run': str(datetime.fromtimestamp(next_ts))
             })
         
         # Get next run time
         if jobs:
-            next_job = min(jobs, key=lambda j: j.next_run if j.next_run else datetime.max)
-            job_info['next_run'] = str(next_job.next_run) if next_job.next_run else None
+            job_info['next_run'] = str(datetime.fromtimestamp(jobs[0][0]))
         
         return job_info
     
@@ -6,6 +6,7 @@ Called by mbuffer when tape needs to be changed
 
 import sys
 import os
+import time
 import logging
 from pathlib import Path
 
@@ -13,20 +14,22 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from core.config_manager import ConfigManager
-from hardware.tape_driver import TapeDriver
+from hardware.tape_driver import TapeDriver, TAPE_LABEL_RE
 from notification.telegram_bot import TelegramBot
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stderr),
-        logging.FileHandler('/tmp/lto_tape_changer.log')
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def setup_logging():
+    """Configure logging; called from main() so importing the module opens no log file"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stderr),
+            logging.FileHandler('/tmp/lto_tape_changer.log')
+        ]
+    )
+
 class TapeChanger:
     """Handles tape changing operations for mbuffer"""
     
@@ -62,7 +65,6 @@ class TapeChanger:
                     except EOFError:
                         # Handle case when called non-interactively
                         print("⏳ Ожидание 30 секунд...", file=sys.stderr)
-                        import time
                         time.sleep(30)
                 else:
                     # Handle robot cleaning
@@ -79,7 +81,6 @@ class TapeChanger:
                         
                         # Wait for cleaning to complete
                         print("⏳ Очистка... (ожидание 60 секунд)", file=sys.stderr)
-                        import time
                         time.sleep(60)
                         
                         # Unload cleaning tape
@@ -127,15 +128,17 @@ class TapeChanger:
                     # Read input
                     label = sys.stdin.readline().strip()
                     
-                    if label:
+                    if not label:
+                        print("❌ Метка не может быть пустой. Попробуйте еще раз.", file=sys.stderr)
+                    elif not TAPE_LABEL_RE.match(label):
+                        print("❌ Недопустимая метка: только латиница, цифры, '_' и '-', до 16 символов.",
+                              file=sys.stderr)
+                    else:
                         # Save tape information
-                        with open(self.tape_driver.tmp_tapes_file, "a") as f:
-                            f.write(f"{label} ")
+                        self.tape_driver.record_used_tape(label)
                         
                         logger.info(f"New tape requested: {label}")
                         return label
-                    else:
-                        print("❌ Метка не может быть пустой. Попробуйте еще раз.", file=sys.stderr)
                         
                 except KeyboardInterrupt:
                     print("\n⏹️  Прервано пользователем", file=sys.stderr)
@@ -167,7 +170,6 @@ class TapeChanger:
                 sys.stdin.readline()
             except:
                 # If stdin is closed, wait a bit
-                import time
                 time.sleep(5)
             
             # Step 5: Rewind new tape
@@ -192,6 +194,8 @@ class TapeChanger:
 
 def main():
     """Main function for tape changer"""
+    setup_logging()
+    
     try:
         # Initialize tape changer
         changer = TapeChanger()
@@ -3,39 +3,48 @@
 Robot controller for automated tape libraries
 """
 
+import re
+import shlex
+import shutil
 import subprocess
+import time
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Sequence, Tuple, Union
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Drive and slot lines of `mtx status` (import/export slots are not matched)
+_MTX_ELEMENT_RE = re.compile(
+    r"^\s*(Storage Element|Data Transfer Element)\s+(\d+)\s*:\s*(Full|Empty)",
+    re.MULTILINE
+)
+
 class RobotController:
     """Controller for tape library robots"""
     
     def __init__(self, robot_dev: str = "/dev/sg3"):
         self.robot_dev = robot_dev
+        self._mtx_prefix = ("mtx", "-f", robot_dev)
         self.mtx_available = self._check_mtx_available()
+        # (time.monotonic() when fetched, parsed get_status() result)
+        self._status_cache: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
         
         if self.mtx_available:
-            logger.info(f"Robot controller initialized for device: {robot_dev}")
+            logger.info("Robot controller initialized for device: %s", robot_dev)
         else:
             logger.warning("mtx command not available, robot functions disabled")
     
     def _check_mtx_available(self) -> bool:
-        """Check if mtx command is available"""
-        try:
-            result = subprocess.run(
-                ["which", "mtx"],
-                capture_output=True,
-                text=True
-            )
-            return result.returncode == 0
-        except:
-            return False
+        """Check if mtx command is available (PATH lookup, no subprocess)"""
+        return shutil.which("mtx") is not None
     
-    def run_mtx_command(self, command: str) -> Dict[str, Any]:
-        """Execute mtx command and return result"""
+    def run_mtx_command(self, command: Union[str, Sequence[str]]) -> Dict[str, Any]:
+        """Execute mtx command and return result
+        
+        command is either a string such as "load 1 0" or the already split
+        arguments; the latter skips shlex parsing.
+        """
         if not self.mtx_available:
             return {
                 'success': False,
@@ -45,24 +54,26 @@ class RobotController:
             }
         
         try:
-            full_cmd = f"mtx -f {self.robot_dev} {command}"
+            if isinstance(command, str):
+                command = shlex.split(command)
+            argv = [*self._mtx_prefix, *command]
             result = subprocess.run(
-                full_cmd,
-                shell=True,
-                capture_output=True,
-                text=True,
+                argv,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 timeout=30
             )
             
+            # Decode once at the end instead of through a text-mode wrapper
             return {
                 'success': result.returncode == 0,
-                'output': result.stdout,
-                'error_output': result.stderr,
+                'output': result.stdout.decode('utf-8', 'replace'),
+                'error_output': result.stderr.decode('utf-8', 'replace'),
                 'return_code': result.returncode
             }
             
         except subprocess.TimeoutExpired:
-            logger.error(f"Timeout executing mtx command: {command}")
+            logger.error("Timeout executing mtx command: %s", command)
             return {
                 'success': False,
                 'error': 'Command timeout',
@@ -70,7 +81,7 @@ class RobotController:
                 'error_output': 'Timeout expired'
             }
         except Exception as e:
-            logger.error(f"Error executing mtx command {command}: {e}")
+            logger.error("Error executing mtx command %s: %s", command, e)
             return {
                 'success': False,
                 'error': str(e),
@@ -78,9 +89,23 @@ class RobotController:
                 'error_output': str(e)
             }
     
-    def get_status(self) -> Dict[str, Any]:
-        """Get robot status"""
-        result = self.run_mtx_command("status")
+    def get_status(self, max_age: float = 1.0) -> Dict[str, Any]:
+        """Get robot status, reusing a result fetched less than max_age seconds ago"""
+        cached_at, cached = self._status_cache
+        if cached is not None and time.monotonic() - cached_at < max_age:
+            return cached
+        
+        status_info = self._get_status_uncached()
+        self._status_cache = (time.monotonic(), status_info)
+        return status_info
+    
+    def invalidate_status(self) -> None:
+        """Drop the cached status after an operation that moves tapes"""
+        self._status_cache = (0.0, None)
+    
+    def _get_status_uncached(self) -> Dict[str, Any]:
+        """Query and parse mtx status"""
+        result = self.run_mtx_command(("status",))
         
         status_info = {
             'available': self.mtx_available,
@@ -92,95 +117,73 @@ class RobotController:
         }
         
         if result['success'] and result['output']:
-            # Parse mtx status output
-            lines = result['output'].strip().split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                
-                # Parse storage slots
-                if 'Storage Element' in line and 'Full' in line:
-                    try:
-                        # Example: "Storage Element 1:Full (Storage Element 1)"
-                        parts = line.split(':')
-                        if len(parts) >= 2:
-                            slot_num = parts[0].split()[-1]
-                            status = 'Full' if 'Full' in parts[1] else 'Empty'
-                            status_info['slots'].append({
-                                'slot': slot_num,
-                                'status': status
-                            })
-                    except:
-                        pass
-                
-                # Parse drives
-                elif 'Data Transfer Element' in line:
-                    try:
-                        # Example: "Data Transfer Element 0:Full (Drive 0)"
-                        parts = line.split(':')
-                        if len(parts) >= 2:
-                            drive_num = parts[0].split()[-1]
-                            status = 'Full' if 'Full' in parts[1] else 'Empty'
-                            status_info['drives'].append({
-                                'drive': drive_num,
-                                'status': status
-                            })
-                    except:
-                        pass
+            # Parse mtx status output, e.g.
+            #   "Data Transfer Element 0:Full (Storage Element 1 Loaded)"
+            #   "      Storage Element 1:Full :VolumeTag=A00001L5"
+            for kind, number, status in _MTX_ELEMENT_RE.findall(result['output']):
+                if kind == 'Storage Element':
+                    status_info['slots'].append({'slot': number, 'status': status})
+                else:
+                    status_info['drives'].append({'drive': number, 'status': status})
         
         return status_info
     
     def load_tape(self, slot: int, drive: int = 0) -> bool:
         """Load tape from slot to drive"""
-        result = self.run_mtx_command(f"load {slot} {drive}")
+        result = self.run_mtx_command(("load", str(slot), str(drive)))
+        self.invalidate_status()
         
         if result['success']:
-            logger.info(f"Loaded tape from slot {slot} to drive {drive}")
+            logger.info("Loaded tape from slot %s to drive %s", slot, drive)
             return True
         else:
-            logger.error(f"Failed to load tape from slot {slot}: {result.get('error_output', 'Unknown error')}")
+            logger.error("Failed to load tape from slot %s: %s", slot, result.get('error_output', 'Unknown error'))
             return False
     
     def unload_tape(self, drive: int = 0, slot: Optional[int] = None) -> bool:
         """Unload tape from drive to slot"""
         if slot is not None:
-            result = self.run_mtx_command(f"unload {slot} {drive}")
+            result = self.run_mtx_command(("unload", str(slot), str(drive)))
         else:
-            result = self.run_mtx_command(f"unload {drive}")
+            result = self.run_mtx_command(("unload", str(drive)))
+        self.invalidate_status()
         
         if result['success']:
-            logger.info(f"Unloaded tape from drive {drive}" + 
-                       (f" to slot {slot}" if slot else ""))
+            logger.info("Unloaded tape from drive %s%s", drive,
+                        f" to slot {slot}" if slot is not None else "")
             return True
         else:
-            logger.error(f"Failed to unload tape from drive {drive}: {result.get('error_output', 'Unknown error')}")
+            logger.error("Failed to unload tape from drive %s: %s", drive, result.get('error_output', 'Unknown error'))
             return False
     
     def transfer_tape(self, source_slot: int, dest_slot: int) -> bool:
         """Transfer tape between slots"""
-        result = self.run_mtx_command(f"transfer {source_slot} {dest_slot}")
+        result = self.run_mtx_command(("transfer", str(source_slot), str(dest_slot)))
+        self.invalidate_status()
         
         if result['success']:
-            logger.info(f"Transferred tape from slot {source_slot} to slot {dest_slot}")
+            logger.info("Transferred tape from slot %s to slot %s", source_slot, dest_slot)
             return True
         else:
-            logger.error(f"Failed to transfer tape: {result.get('error_output', 'Unknown error')}")
+            logger.error("Failed to transfer tape: %s", result.get('error_output', 'Unknown error'))
             return False
     
     def load_cleaning_tape(self, cleaning_slot: int, drive: int = 0) -> bool:
         """Load cleaning tape"""
-        result = self.run_mtx_command(f"load {cleaning_slot} {drive}")
+        result = self.run_mtx_command(("load", str(cleaning_slot), str(drive)))
+        self.invalidate_status()
         
         if result['success']:
-            logger.info(f"Loaded cleaning tape from slot {cleaning_slot} to drive {drive}")
+            logger.info("Loaded cleaning tape from slot %s to drive %s", cleaning_slot, drive)
             return True
         else:
-            logger.error(f"Failed to load cleaning tape: {result.get('error_output', 'Unknown error')}")
+            logger.error("Failed to load cleaning tape: %s", result.get('error_output', 'Unknown error'))
             return False
     
-    def inventory(self) -> List[Dict[str, Any]]:
-        """Get inventory of tapes in library"""
-        status = self.get_status()
+    def inventory(self, status: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Get inventory of tapes in library (from status if already fetched)"""
+        if status is None:
+            status = self.get_status()
         
         if not status['success']:
             return []
@@ -207,9 +210,10 @@ class RobotController:
         
         return inventory
     
-    def get_tape_positions(self) -> Dict[str, List[int]]:
-        """Get current tape positions"""
-        status = self.get_status()
+    def get_tape_positions(self, status: Optional[Dict[str, Any]] = None) -> Dict[str, List[int]]:
+        """Get current tape positions (from status if already fetched)"""
+        if status is None:
+            status = self.get_status()
         
         positions = {
             'loaded_drives': [],
@@ -233,20 +237,23 @@ class RobotController:
         
         return positions
     
-    def is_operational(self) -> bool:
-        """Check if robot is operational"""
+    def is_operational(self, status: Optional[Dict[str, Any]] = None) -> bool:
+        """Check if robot is operational (from status if already fetched)"""
         if not self.mtx_available:
             return False
         
         # Try to get status
-        result = self.run_mtx_command("status")
-        return result['success']
+        if status is None:
+            status = self.get_status()
+        return status['success']
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get robot statistics"""
+        # One status fetch shared by every field of the report
+        status = self.get_status()
         return {
             'mtx_available': self.mtx_available,
             'device': self.robot_dev,
-            'operational': self.is_operational(),
-            'inventory_count': len(self.inventory())
+            'operational': self.is_operational(status),
+            'inventory_count': len(self.inventory(status))
         }
\ No newline at end of file
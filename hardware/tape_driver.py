@@ -1,15 +1,49 @@
 import subprocess
 import re
 import os
+import sys
+import fcntl
+import struct
+import shutil
 import json
+import time
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List, Set
 from core.config_manager import ConfigManager
 
 logger = logging.getLogger(__name__)
 
+# Поля вывода `mt status`: одно регулярное выражение на все поля,
+# вывод просматривается за один проход
+_MT_STATUS_RE = re.compile(
+    r"file number=(?P<file_number>[0-9]+)"
+    r"|block number=(?P<block_number>[0-9]+)"
+    r"|partition=(?P<partition>[0-9]+)"
+    r"|density code=(?P<density>[0-9x]+)"
+    r"|soft errors=(?P<soft_errors>[0-9]+)"
+    r"|general status bits.*?\((?P<general_status>.*?)\)",
+    re.IGNORECASE
+)
+
+# Допустимая метка кассеты: буквы, цифры, '_' и '-' (метки пишутся в файлы
+# состояния и в сообщения, пробелы и спецсимволы оболочки в них не допускаются)
+TAPE_LABEL_RE = re.compile(r"^[A-Za-z0-9_-]{1,16}$")
+
+# struct mtget из <sys/mtio.h>: mt_type, mt_resid, mt_dsreg, mt_gstat,
+# mt_erreg (long), mt_fileno, mt_blkno (daddr_t = int)
+_MTGET_FORMAT = "lllllii"
+# MTIOCGET = _IOR('m', 2, struct mtget) в кодировке asm-generic (x86, arm)
+MTIOCGET = (2 << 30) | (struct.calcsize(_MTGET_FORMAT) << 16) | (ord('m') << 8) | 2
+MT_ST_DENSITY_MASK = 0xff000000
+MT_ST_DENSITY_SHIFT = 24
+MT_ST_SOFTERR_MASK = 0xffff
+GMT_ONLINE = 0x01000000
+
+# Емкость в выводе tapeinfo
+_CAPACITY_RE = re.compile(r"capacity[^0-9\n]*([0-9.]+)\s*(GB|TB|MB)", re.IGNORECASE)
+
 class TapeDriver:
     """Драйвер для управления ленточным накопителем"""
     
@@ -23,40 +57,65 @@ class TapeDriver:
         self.err_threshold = hardware_params['err_threshold']
         self.auto_rewind = hardware_params['auto_rewind']
         
+        # Неизменные начала argv для mt и tapeinfo
+        self._mt_prefix = ("mt", "-f", self.tape_dev)
+        self._tapeinfo_argv = ["tapeinfo", "-f", self.tape_dev]
+        
         self.tmp_tapes_file = "/tmp/current_backup_tapes.txt"
         self.last_clean_file = "/tmp/last_clean_time.txt"
         self.tape_stats_file = "/tmp/tape_statistics.json"
         
+        # Наличие tapeinfo проверяется один раз при первом обращении
+        self._has_tapeinfo: Optional[bool] = None
+        # (время получения по time.monotonic(), результат status())
+        self._status_cache: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+        # Разобранная статистика лент и (mtime_ns, size) файла, из которого она прочитана
+        self._stats: Dict[str, Any] = {}
+        self._stats_key: Optional[tuple] = None
+        # Метки использованных лент и (mtime_ns, size) файла tmp_tapes_file
+        self._used_tapes: Set[str] = set()
+        self._used_tapes_key: Optional[tuple] = None
+        # Дескриптор tmp_tapes_file, открытый на дозапись (O_APPEND)
+        self._tapes_fd: Optional[int] = None
+        
         # Инициализируем временные файлы
         self._init_temp_files()
         
-        logger.info(f"Инициализирован драйвер ленты для устройства: {self.tape_dev}")
+        logger.info("Инициализирован драйвер ленты для устройства: %s", self.tape_dev)
         if self.has_robot:
-            logger.info(f"Автоматический робот: {self.robot_dev}")
+            logger.info("Автоматический робот: %s", self.robot_dev)
     
     def _init_temp_files(self) -> None:
         """Инициализировать временные файлы"""
-        for file_path in [self.tmp_tapes_file, self.last_clean_file, self.tape_stats_file]:
-            Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-            if not Path(file_path).exists():
-                Path(file_path).touch()
+        for file_path in (self.tmp_tapes_file, self.last_clean_file, self.tape_stats_file):
+            # Обычно файлы уже есть: один stat без mkdir/touch
+            if os.path.exists(file_path):
+                continue
+            path = Path(file_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
     
-    def run_command(self, cmd: str, timeout: int = 30) -> Tuple[str, str, int]:
-        """Выполнить системную команду с таймаутом"""
+    def run_command(self, cmd: List[str], timeout: int = 30,
+                    capture_stderr: bool = True) -> Tuple[str, str, int]:
+        """Выполнить системную команду (список аргументов, без shell) с таймаутом
+        
+        Если stderr вызывающему не нужен (capture_stderr=False), он
+        отправляется в /dev/null без отдельного канала.
+        """
         try:
             result = subprocess.run(
                 cmd, 
-                shell=True, 
-                capture_output=True, 
-                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE if capture_stderr else subprocess.DEVNULL,
                 timeout=timeout
             )
-            return result.stdout, result.stderr, result.returncode
+            stderr = result.stderr.decode('utf-8', 'replace') if capture_stderr else ""
+            return result.stdout.decode('utf-8', 'replace'), stderr, result.returncode
         except subprocess.TimeoutExpired:
-            logger.error(f"Таймаут выполнения команды: {cmd}")
+            logger.error("Таймаут выполнения команды: %s", ' '.join(cmd))
             return "", "Command timeout", 124
         except Exception as e:
-            logger.error(f"Ошибка выполнения команды {cmd}: {e}")
+            logger.error("Ошибка выполнения команды %s: %s", ' '.join(cmd), e)
             return "", str(e), 1
     
     def beep(self) -> None:
@@ -64,77 +123,138 @@ class TapeDriver:
         sound_enabled = self.config.get('notifications', 'sound_alerts', True)
         
         if sound_enabled:
-            print('\a', end='', flush=True)
-            
-            # Альтернативные методы звукового сигнала
-            try:
-                subprocess.run(["echo", "-e", "\a"], capture_output=True, check=False)
-            except:
-                pass
+            if sys.stdout.isatty():
+                print('\a', end='', flush=True)
+            else:
+                # stdout перенаправлен (например, скрипт смены ленты под mbuffer) -
+                # сигнал подается прямо в управляющий терминал
+                try:
+                    with open('/dev/tty', 'wb', buffering=0) as tty:
+                        tty.write(b'\a')
+                except OSError:
+                    pass
     
     def rewind(self) -> bool:
         """Перемотать ленту к началу"""
         if self.auto_rewind:
-            stdout, stderr, code = self.run_command(f"mt -f {self.tape_dev} rewind")
+            stdout, stderr, code = self.run_command([*self._mt_prefix, "rewind"])
             
+            self.invalidate_status()
             if code == 0:
                 logger.info("Лента перемотана к началу")
                 return True
             else:
-                logger.error(f"Ошибка перемотки ленты: {stderr}")
+                logger.error("Ошибка перемотки ленты: %s", stderr)
                 return False
         return True
     
-    def status(self) -> Dict[str, Any]:
-        """Получить подробный статус ленты"""
+    def status(self, max_age: float = 1.0) -> Dict[str, Any]:
+        """Получить подробный статус ленты
+        
+        Результат не старше max_age секунд берется из кэша, чтобы несколько
+        подряд идущих запросов не запускали mt и tapeinfo повторно.
+        """
+        cached_at, cached = self._status_cache
+        if cached is not None and time.monotonic() - cached_at < max_age:
+            return dict(cached)
+        
+        status_info = self._status_uncached()
+        self._status_cache = (time.monotonic(), status_info)
+        return dict(status_info)
+    
+    def invalidate_status(self) -> None:
+        """Сбросить кэш статуса после операций, меняющих состояние ленты"""
+        self._status_cache = (0.0, None)
+    
+    def _status_uncached(self) -> Dict[str, Any]:
+        """Запросить статус ленты (ioctl MTIOCGET, при неудаче - mt) и tapeinfo"""
+        status_info = self._ioctl_status()
+        if status_info is None:
+            status_info = self._mt_status()
+        
+        if 'error' not in status_info:
+            # Чистка и емкость берутся из одного вызова tapeinfo
+            stdout_info = ""
+            if self._supports_tapeinfo():
+                stdout_info, _, _ = self.run_command(self._tapeinfo_argv, capture_stderr=False)
+            
+            status_info['cleaning_needed'] = "Cleaning bit: yes" in stdout_info
+            
+            match = _CAPACITY_RE.search(stdout_info)
+            if match:
+                status_info['capacity'] = f"{match.group(1)} {match.group(2)}"
+        
+        return status_info
+    
+    def _ioctl_status(self) -> Optional[Dict[str, Any]]:
+        """Прочитать статус привода ioctl MTIOCGET без запуска mt
+        
+        Возвращает те же поля, что разбираются из вывода `mt status`,
+        или None, если ioctl недоступен (не Linux, устройство занято и т.п.).
+        """
+        if not sys.platform.startswith('linux'):
+            return None
+        
+        try:
+            # O_NONBLOCK: открыть привод и без загруженной ленты, как это делает mt
+            fd = os.open(self.tape_dev, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            return None
+        
+        try:
+            buf = fcntl.ioctl(fd, MTIOCGET, bytes(struct.calcsize(_MTGET_FORMAT)))
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+        
+        _, resid, dsreg, gstat, erreg, fileno, blkno = struct.unpack(_MTGET_FORMAT, buf)
+        density = (dsreg & MT_ST_DENSITY_MASK) >> MT_ST_DENSITY_SHIFT
+        
+        status_info = {
+            # Драйвер st возвращает текущий раздел в mt_resid
+            'partition': str(resid),
+            'density': f"0x{density:02x}",
+            'soft_errors': str(erreg & MT_ST_SOFTERR_MASK),
+            'general_status': f"{gstat & 0xffffffff:x}",
+            'online': bool(gstat & GMT_ONLINE)
+        }
+        
+        # -1 означает, что драйвер не знает позицию; разбор вывода mt такие
+        # значения тоже пропускал, и get_file_number() возвращал '0'
+        if fileno >= 0:
+            status_info['file_number'] = str(fileno)
+        if blkno >= 0:
+            status_info['block_number'] = str(blkno)
+        
+        return status_info
+    
+    def _mt_status(self) -> Dict[str, Any]:
+        """Получить статус привода из вывода `mt status`"""
         status_info = {}
         
-        # Базовая команда статуса
-        stdout, stderr, code = self.run_command(f"mt -f {self.tape_dev} status")
+        stdout, stderr, code = self.run_command([*self._mt_prefix, "status"])
         
         if code == 0:
-            # Парсим вывод команды mt
-            patterns = {
-                'file_number': r"file number=([0-9]+)",
-                'block_number': r"block number=([0-9]+)",
-                'partition': r"partition=([0-9]+)",
-                'density': r"density code=([0-9x]+)",
-                'soft_errors': r"soft errors=([0-9]+)",
-                'general_status': r"general status bits.*?\((.*?)\)"
-            }
-            
-            for key, pattern in patterns.items():
-                match = re.search(pattern, stdout, re.IGNORECASE)
-                if match:
-                    status_info[key] = match.group(1)
+            # Парсим вывод команды mt (для каждого поля берется первое вхождение)
+            for match in _MT_STATUS_RE.finditer(stdout):
+                key = match.lastgroup
+                if key not in status_info:
+                    status_info[key] = match.group(key)
             
             # Проверка на ошибки
-            if "ONLINE" in stdout:
-                status_info['online'] = True
-            else:
-                status_info['online'] = False
-            
-            # Проверка на чистку
-            stdout_clean, _, _ = self.run_command(f"tapeinfo -f {self.tape_dev}")
-            status_info['cleaning_needed'] = "Cleaning bit: yes" in stdout_clean
-            
-            # Получение информации о емкости
-            if self._supports_tapeinfo():
-                stdout_cap, _, _ = self.run_command(f"tapeinfo -f {self.tape_dev} | grep -i capacity")
-                if stdout_cap:
-                    match = re.search(r"([0-9.]+)\s*(GB|TB|MB)", stdout_cap)
-                    if match:
-                        status_info['capacity'] = f"{match.group(1)} {match.group(2)}"
+            status_info['online'] = "ONLINE" in stdout
         else:
-            logger.error(f"Ошибка получения статуса ленты: {stderr}")
+            logger.error("Ошибка получения статуса ленты: %s", stderr)
             status_info['error'] = stderr
         
         return status_info
     
     def _supports_tapeinfo(self) -> bool:
         """Проверить поддержку команды tapeinfo"""
-        stdout, stderr, code = self.run_command("which tapeinfo")
-        return code == 0
+        if self._has_tapeinfo is None:
+            self._has_tapeinfo = shutil.which("tapeinfo") is not None
+        return self._has_tapeinfo
     
     def get_file_number(self) -> str:
         """Получить текущий номер файла на ленте"""
@@ -143,13 +263,14 @@ class TapeDriver:
     
     def forward_space_files(self, count: int) -> bool:
         """Перемотать вперед на указанное количество файлов"""
-        stdout, stderr, code = self.run_command(f"mt -f {self.tape_dev} fsf {count}")
+        stdout, stderr, code = self.run_command([*self._mt_prefix, "fsf", str(count)])
+        self.invalidate_status()
         
         if code == 0:
-            logger.info(f"Перемотано вперед на {count} файлов")
+            logger.info("Перемотано вперед на %s файлов", count)
             return True
         else:
-            logger.error(f"Ошибка перемотки вперед: {stderr}")
+            logger.error("Ошибка перемотки вперед: %s", stderr)
             return False
     
     def check_cleaning_needed(self) -> bool:
@@ -175,112 +296,177 @@ class TapeDriver:
         while True:
             label = input("📝 Введите метку следующей кассеты: ").strip()
             
-            if label:
+            if not label:
+                print("❌ Метка не может быть пустой. Попробуйте еще раз.")
+            elif not TAPE_LABEL_RE.match(label):
+                print("❌ Недопустимая метка: только латиница, цифры, '_' и '-', до 16 символов.")
+            else:
                 # Сохраняем информацию о ленте
-                with open(self.tmp_tapes_file, "a") as f:
-                    f.write(f"{label} ")
+                self.record_used_tape(label)
                 
-                logger.info(f"Запрошена лента с меткой: {label}")
+                logger.info("Запрошена лента с меткой: %s", label)
                 return label
-            else:
-                print("❌ Метка не может быть пустой. Попробуйте еще раз.")
+    
+    def _read_tape_stats(self) -> Dict[str, Any]:
+        """Получить статистику лент
+        
+        Файл пишет и скрипт смены ленты, запущенный mbuffer в отдельном
+        процессе, поэтому он перечитывается только при изменении mtime/размера.
+        """
+        try:
+            st = os.stat(self.tape_stats_file)
+        except FileNotFoundError:
+            self._stats, self._stats_key = {}, None
+            return self._stats
+        
+        key = (st.st_mtime_ns, st.st_size)
+        if key != self._stats_key:
+            with open(self.tape_stats_file, 'r') as f:
+                data = f.read()
+            try:
+                # Пустой файл создается в _init_temp_files
+                self._stats = json.loads(data) if data.strip() else {}
+            except ValueError:
+                logger.error("Поврежден файл статистики лент: %s", self.tape_stats_file)
+                self._stats = {}
+            self._stats_key = key
+        
+        return self._stats
+    
+    def _flush_tape_stats(self) -> None:
+        """Атомарно записать статистику лент на диск"""
+        tmp_file = f"{self.tape_stats_file}.tmp.{os.getpid()}"
+        with open(tmp_file, 'w') as f:
+            json.dump(self._stats, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.tape_stats_file)
+        
+        st = os.stat(self.tape_stats_file)
+        self._stats_key = (st.st_mtime_ns, st.st_size)
+    
+    def record_used_tape(self, label: str) -> None:
+        """Дописать метку ленты в список использованных одним вызовом write()"""
+        if self._tapes_fd is None:
+            self._tapes_fd = os.open(
+                self.tmp_tapes_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+        os.write(self._tapes_fd, f"{label} ".encode('utf-8'))
     
     def record_cleaning_time(self) -> None:
         """Записать время последней чистки"""
         clean_time = datetime.now().isoformat()
         
         try:
-            stats = {}
-            
-            if Path(self.tape_stats_file).exists():
-                with open(self.tape_stats_file, 'r') as f:
-                    stats = json.load(f)
+            stats = self._read_tape_stats()
             
+            self.invalidate_status()
             stats['last_cleaning'] = clean_time
             stats['cleaning_count'] = stats.get('cleaning_count', 0) + 1
             
-            with open(self.tape_stats_file, 'w') as f:
-                json.dump(stats, f, indent=2)
-            
-            # Также сохраняем в простом текстовом формате для совместимости
-            with open(self.last_clean_file, "w") as f:
-                f.write(clean_time)
+            self._flush_tape_stats()
             
-            logger.info(f"Записано время чистки: {clean_time}")
+            logger.info("Записано время чистки: %s", clean_time)
             
         except Exception as e:
-            logger.error(f"Ошибка записи времени чистки: {e}")
+            logger.error("Ошибка записи времени чистки: %s", e)
     
     def get_last_clean_time(self) -> str:
         """Получить время последней чистки"""
         try:
-            if Path(self.tape_stats_file).exists():
-                with open(self.tape_stats_file, 'r') as f:
-                    stats = json.load(f)
-                    last_clean = stats.get('last_cleaning', '')
-                    
-                    if last_clean:
-                        clean_dt = datetime.fromisoformat(last_clean)
-                        return clean_dt.strftime("%Y-%m-%d %H:%M:%S")
+            last_clean = self._read_tape_stats().get('last_cleaning', '')
+            if last_clean:
+                clean_dt = datetime.fromisoformat(last_clean)
+                return clean_dt.strftime("%Y-%m-%d %H:%M:%S")
             
-            # Запасной вариант - текстовый файл
-            if Path(self.last_clean_file).exists():
+            # Запасной вариант - текстовый файл, который писали прежние версии
+            try:
                 with open(self.last_clean_file, "r") as f:
                     content = f.read().strip()
-                    if content:
-                        try:
-                            clean_dt = datetime.fromisoformat(content)
-                            return clean_dt.strftime("%Y-%m-%d %H:%M:%S")
-                        except:
-                            return content
+            except FileNotFoundError:
+                content = ""
+            
+            if content:
+                try:
+                    clean_dt = datetime.fromisoformat(content)
+                    return clean_dt.strftime("%Y-%m-%d %H:%M:%S")
+                except ValueError:
+                    return content
             
         except Exception as e:
-            logger.error(f"Ошибка чтения времени чистки: {e}")
+            logger.error("Ошибка чтения времени чистки: %s", e)
         
         return "Нет данных"
     
+    def _read_used_tapes(self) -> Set[str]:
+        """Получить множество меток использованных лент
+        
+        Метки дописывает и процесс смены ленты, поэтому файл перечитывается
+        только при изменении его mtime/размера.
+        """
+        try:
+            st = os.stat(self.tmp_tapes_file)
+        except FileNotFoundError:
+            self._used_tapes, self._used_tapes_key = set(), None
+            return self._used_tapes
+        
+        key = (st.st_mtime_ns, st.st_size)
+        if key != self._used_tapes_key:
+            with open(self.tmp_tapes_file, "r") as f:
+                self._used_tapes = set(f.read().split())
+            self._used_tapes_key = key
+        
+        return self._used_tapes
+    
     def get_used_tapes(self) -> str:
         """Получить список использованных лент"""
         try:
-            if Path(self.tmp_tapes_file).exists():
-                with open(self.tmp_tapes_file, "r") as f:
-                    tapes = f.read().strip()
-                    if tapes:
-                        # Убираем дубликаты и сортируем
-                        tape_list = list(set(tapes.split()))
-                        tape_list.sort()
-                        return " ".join(tape_list)
+            tapes = self._read_used_tapes()
+            if tapes:
+                return " ".join(sorted(tapes))
         except Exception as e:
-            logger.error(f"Ошибка чтения списка лент: {e}")
+            logger.error("Ошибка чтения списка лент: %s", e)
         
         return "N/A"
     
+    def get_used_tape_count(self) -> int:
+        """Получить количество использованных лент без сборки строки меток"""
+        try:
+            return len(self._read_used_tapes())
+        except Exception as e:
+            logger.error("Ошибка чтения списка лент: %s", e)
+            return 0
+    
     def clear_temp_files(self) -> None:
         """Очистить временные файлы"""
         try:
-            for file_path in [self.tmp_tapes_file, self.last_clean_file]:
-                if Path(file_path).exists():
-                    Path(file_path).unlink()
+            if self._tapes_fd is not None:
+                os.close(self._tapes_fd)
+                self._tapes_fd = None
             
             # Файл статистики не удаляем, только очищаем текущие ленты
-            if Path(self.tmp_tapes_file).exists():
-                Path(self.tmp_tapes_file).touch()
+            for file_path in [self.tmp_tapes_file, self.last_clean_file]:
+                try:
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    pass
             
+            self._used_tapes, self._used_tapes_key = set(), None
             self._init_temp_files()
             logger.info("Временные файлы очищены")
             
         except Exception as e:
-            logger.error(f"Ошибка очистки временных файлов: {e}")
+            logger.error("Ошибка очистки временных файлов: %s", e)
     
     def get_tape_statistics(self) -> Dict[str, Any]:
         """Получить статистику использования лент"""
         try:
-            if Path(self.tape_stats_file).exists():
-                with open(self.tape_stats_file, 'r') as f:
-                    return json.load(f)
+            stats = self._read_tape_stats()
+            if stats:
+                return dict(stats)
             
         except Exception as e:
-            logger.error(f"Ошибка чтения статистики: {e}")
+            logger.error("Ошибка чтения статистики: %s", e)
         
         return {
             'backup_count': 0,
@@ -8,6 +8,7 @@ import sys
 import os
 import argparse
 import logging
+import shutil
 from pathlib import Path
 from datetime import datetime
 
@@ -23,18 +24,88 @@ else:
 sys.path.insert(0, str(BASE_DIR))
 
 try:
-    from core.config_manager import ConfigManager
-    from core.backup_engine import BackupEngine
-    from core.registry_manager import RegistryManager
-    from core.scheduler import BackupScheduler
-    from hardware.tape_driver import TapeDriver
-    from notification.telegram_bot import TelegramBot
+    # Остальные модули (движок, планировщик, Telegram) импортируются
+    # при первом обращении к соответствующему компоненту
+    import yaml
+    from core.config_manager import ConfigManager, SafeDumper
     from utils.dependencies import DependencyChecker
 except ImportError as e:
     print(f"❌ Ошибка импорта модулей: {e}")
     print("Запустите setup.py для установки зависимостей")
     sys.exit(1)
 
+# Версия и окружение не меняются за время работы процесса
+VERSION_INFO = f"""\
+LTO Backup System v2.0.0
+Binary: {'Yes' if IS_BINARY else 'No'}
+Python: {sys.version}
+Platform: {sys.platform}"""
+
+# Маркер успешной проверки зависимостей (см. _check_dependencies)
+DEPS_MARKER = Path.home() / ".cache" / "lto_backup" / "deps.ok"
+
+# Конфигурация по умолчанию, уже в виде YAML: записывается одним write()
+DEFAULT_CONFIG_YAML = """\
+common:
+  registry_csv: backup_registry.csv
+  manifest_dir: ./manifests
+  log_level: INFO
+  retention_days: 90
+hardware:
+  has_robot: false
+  robot_dev: /dev/sg3
+  tape_dev: /dev/nst0
+  err_threshold: 50
+  auto_rewind: true
+mbuffer:
+  size: 2G
+  fill_percent: 90%
+  block_size: 256k
+  change_script: lto_backup change_tape
+  min_rate: 100M
+  max_rate: 150M
+telegram:
+  enabled: true
+  token: YOUR_BOT_TOKEN_HERE
+  chat_id: YOUR_CHAT_ID_HERE
+  notification_level: INFO
+  backup_started: true
+  backup_completed: true
+  backup_failed: true
+  tape_change: true
+  cleaning_required: true
+backup:
+  compression: none
+  verify_after_backup: true
+  create_manifest: true
+  max_file_size: 100G
+  split_large_files: true
+exclude:
+  patterns:
+  - /proc
+  - /sys
+  - /dev
+  - /run
+  - /tmp
+  - '*.log'
+  - '*.tmp'
+  - '*.temp'
+  - .git
+  - .svn
+  - .hg
+  - .DS_Store
+  - Thumbs.db
+  - '*.pyc'
+  - __pycache__
+  - .cache
+  - .npm
+  - .yarn
+  max_file_size: 10G
+  min_file_size: 1k
+  exclude_older_than: 365d
+  exclude_newer_than: 0d
+"""
+
 class LTOBackupSystem:
     """Главный класс системы резервного копирования LTO"""
     
@@ -46,33 +117,39 @@ class LTOBackupSystem:
         # Определяем путь к конфигурации
         if config_path is None:
             # Ищем config.yaml в стандартных расположениях
+            cwd = os.getcwd()
             possible_paths = [
-                Path.cwd() / "config.yaml",
-                Path.cwd() / "config.yml",
-                self.binary_dir / "config.yaml",
-                Path.home() / ".config" / "lto_backup" / "config.yaml",
-                Path("/etc") / "lto_backup" / "config.yaml",
+                os.path.join(cwd, "config.yaml"),
+                os.path.join(cwd, "config.yml"),
+                os.path.join(str(self.binary_dir), "config.yaml"),
+                os.path.join(os.path.expanduser("~"), ".config", "lto_backup", "config.yaml"),
+                "/etc/lto_backup/config.yaml",
             ]
             
             for path in possible_paths:
-                if path.exists():
-                    config_path = str(path)
-                    break
+                try:
+                    os.stat(path)
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                config_path = path
+                break
             else:
                 # Если конфиг не найден, создаем в текущей директории
-                config_path = str(Path.cwd() / "config.yaml")
-                if not Path(config_path).exists():
-                    self._create_default_config(config_path)
+                config_path = possible_paths[0]
+                self._create_default_config(config_path)
         
         self.config_path = config_path
         self.config = ConfigManager(config_path)
         
-        # Инициализируем компоненты
-        self.backup_engine = BackupEngine(self.config)
-        self.registry = RegistryManager(self.config)
-        self.tape_driver = TapeDriver(self.config)
-        self.bot = TelegramBot(self.config)
-        self.scheduler = BackupScheduler(self.config)
+        # Компоненты создаются при первом обращении: change_tape,
+        # вызываемый mbuffer, не должен поднимать движок и планировщик
+        self._backup_engine = None
+        self._registry = None
+        self._tape_driver = None
+        self._bot = None
+        self._scheduler = None
+        # Список бэкапов реестра, прочитанный в рамках текущей команды
+        self._backups = None
         
         # Создаем необходимые директории
         self._create_directories()
@@ -80,67 +157,62 @@ class LTOBackupSystem:
         self.logger.info(f"Инициализирована система LTO Backup")
         self.logger.info(f"Конфигурация: {self.config_path}")
     
+    @property
+    def backup_engine(self):
+        """Движок резервного копирования"""
+        if self._backup_engine is None:
+            from core.backup_engine import BackupEngine
+            self._backup_engine = BackupEngine(
+                self.config,
+                tape_driver=self.tape_driver,
+                registry=self.registry,
+                bot=self.bot
+            )
+        return self._backup_engine
+    
+    @property
+    def registry(self):
+        """Реестр бэкапов"""
+        if self._registry is None:
+            from core.registry_manager import RegistryManager
+            self._registry = RegistryManager(self.config)
+        return self._registry
+    
+    @property
+    def tape_driver(self):
+        """Драйвер ленточного привода"""
+        if self._tape_driver is None:
+            from hardware.tape_driver import TapeDriver
+            self._tape_driver = TapeDriver(self.config)
+        return self._tape_driver
+    
+    @property
+    def bot(self):
+        """Telegram бот"""
+        if self._bot is None:
+            from notification.telegram_bot import TelegramBot
+            self._bot = TelegramBot(self.config)
+        return self._bot
+    
+    @property
+    def scheduler(self):
+        """Планировщик бэкапов"""
+        if self._scheduler is None:
+            from core.scheduler import BackupScheduler
+            self._scheduler = BackupScheduler(self.config)
+        return self._scheduler
+    
+    def _get_backups(self):
+        """Получить список бэкапов, прочитав реестр один раз"""
+        if self._backups is None:
+            self._backups = self.registry.list_backups()
+        return self._backups
+    
     def _create_default_config(self, config_path):
         """Создать конфигурацию по умолчанию"""
-        import yaml
-        
-        default_config = {
-            'common': {
-                'registry_csv': 'backup_registry.csv',
-                'manifest_dir': './manifests',
-                'log_level': 'INFO',
-                'retention_days': 90
-            },
-            'hardware': {
-                'has_robot': False,
-                'robot_dev': '/dev/sg3',
-                'tape_dev': '/dev/nst0',
-                'err_threshold': 50,
-                'auto_rewind': True
-            },
-            'mbuffer': {
-                'size': '2G',
-                'fill_percent': '90%',
-                'block_size': '256k',
-                'change_script': 'lto_backup change_tape',
-                'min_rate': '100M',
-                'max_rate': '150M'
-            },
-            'telegram': {
-                'enabled': True,
-                'token': 'YOUR_BOT_TOKEN_HERE',
-                'chat_id': 'YOUR_CHAT_ID_HERE',
-                'notification_level': 'INFO',
-                'backup_started': True,
-                'backup_completed': True,
-                'backup_failed': True,
-                'tape_change': True,
-                'cleaning_required': True
-            },
-            'backup': {
-                'compression': 'none',
-                'verify_after_backup': True,
-                'create_manifest': True,
-                'max_file_size': '100G',
-                'split_large_files': True
-            },
-            'exclude': {
-                'patterns': [
-                    '/proc', '/sys', '/dev', '/run', '/tmp',
-                    '*.log', '*.tmp', '*.temp', '.git',
-                    '.svn', '.hg', '.DS_Store', 'Thumbs.db',
-                    '*.pyc', '__pycache__', '.cache', '.npm', '.yarn'
-                ],
-                'max_file_size': '10G',
-                'min_file_size': '1k',
-                'exclude_older_than': '365d',
-                'exclude_newer_than': '0d'
-            }
-        }
-        
         Path(config_path).parent.mkdir(parents=True, exist_ok=True)
         with open(config_path, 'w', encoding='utf-8') as f:
-            yaml.dump(default_config, f, default_flow_style=False, allow_unicode=True, indent=2)
+            f.write(DEFAULT_CONFIG_YAML)
         
         print(f"📝 Создан файл конфигурации: {config_path}")
         print("⚠️  Отредактируйте его перед использованием!")
@@ -156,10 +228,49 @@ class LTOBackupSystem:
             if dir_path:
                 Path(dir_path).mkdir(parents=True, exist_ok=True)
     
-    def _check_dependencies(self):
-        """Проверить системные зависимости"""
+    def _check_dependencies(self, use_marker=False):
+        """Проверить системные зависимости
+        
+        С use_marker=True успешная проверка запоминается в DEPS_MARKER и
+        повторно не выполняется, пока не изменится каталог из PATH или
+        устройство ленты.
+        """
+        if use_marker and self._deps_marker_valid():
+            return True
+        
         checker = DependencyChecker()
-        return checker.check_all()
+        all_ok = checker.check_all()
+        
+        if all_ok:
+            try:
+                DEPS_MARKER.parent.mkdir(parents=True, exist_ok=True)
+                DEPS_MARKER.touch()
+            except OSError as e:
+                self.logger.debug("Не удалось обновить маркер зависимостей: %s", e)
+        
+        return all_ok
+    
+    def _deps_marker_valid(self):
+        """Маркер успешной проверки зависимостей новее каталогов PATH и устройства ленты"""
+        try:
+            marker_mtime = os.stat(DEPS_MARKER).st_mtime_ns
+        except OSError:
+            return False
+        
+        tape_dev_stat = self.config.tape_dev_stat
+        if tape_dev_stat is None:
+            return False
+        
+        # Установка или удаление утилиты меняет mtime каталога,
+        # смена прав на устройство - его ctime
+        newest = tape_dev_stat.st_ctime_ns
+        for directory in os.environ.get('PATH', os.defpath).split(os.pathsep):
+            try:
+                newest = max(newest, os.stat(directory).st_mtime_ns)
+            except OSError:
+                continue
+        
+        return marker_mtime >= newest
     
     def backup(self, source, label):
         """Выполнить резервное копирование"""
@@ -174,12 +285,16 @@ class LTOBackupSystem:
             return False
         
         # Проверка зависимостей
-        if not self._check_dependencies():
+        if not self._check_dependencies(use_marker=True):
             response = input("Продолжить? (y/N): ").lower()
             if response != 'y':
                 return False
         
-        return self.backup_engine.backup(source, label)
+        try:
+            return self.backup_engine.backup(source, label)
+        finally:
+            # Реестр пополнился новой записью
+            self._backups = None
     
     def restore(self, destination, label):
         """Восстановить данные"""
@@ -227,7 +342,7 @@ class LTOBackupSystem:
     
     def list_backups(self):
         """Показать список бэкапов"""
-        backups = self.registry.list_backups()
+        backups = self._get_backups()
         
         if not backups:
             print("📭 Реестр бэкапов пуст")
@@ -236,9 +351,12 @@ class LTOBackupSystem:
         print(f"📋 Найдено бэкапов: {len(backups)}")
         print("=" * 80)
         
-        for i, backup in enumerate(backups, 1):
-            print(f"{i:3}. {backup['timestamp']} | {backup['label']:30} | "
-                  f"Ленты: {backup['tapes']:20} | Файл: {backup['file_number']}")
+        # Весь список выводится одним write()
+        sys.stdout.write("".join(
+            f"{i:3}. {backup['timestamp']} | {backup['label']:30} | "
+            f"Ленты: {backup['tapes']:20} | Файл: {backup['file_number']}\n"
+            for i, backup in enumerate(backups, 1)
+        ))
     
     def check_system(self):
         """Проверить состояние системы"""
@@ -256,6 +374,7 @@ class LTOBackupSystem:
         self._check_dependencies()
         
         print(f"\n💾 Проверка оборудования:")
+        # Один запрос статуса и для доступности, и для признака чистки
         status = self.tape_driver.status()
         if status.get('online', False):
             print("✅ Ленточный накопитель доступен")
@@ -264,19 +383,19 @@ class LTOBackupSystem:
         else:
             print("❌ Ленточный накопитель недоступен")
         
-        if self.tape_driver.check_cleaning_needed():
+        if status.get('cleaning_needed', False):
             print("⚠️  Требуется чистка ленты!")
         else:
             print("✅ Чистка ленты не требуется")
         
         print(f"\n🤖 Проверка Telegram:")
-        if self.bot.send_message("✅ Тестовое сообщение от LTO Backup System"):
+        if self.bot.send_message("✅ Тестовое сообщение от LTO Backup System", wait=True):
             print("✅ Telegram бот работает")
         else:
             print("⚠️  Telegram бот не настроен или недоступен")
         
         print(f"\n📊 Проверка реестра:")
-        backups = self.registry.list_backups()
+        backups = self._get_backups()
         print(f"   Записей в реестре: {len(backups)}")
         
         print("\n" + "=" * 60)
@@ -284,16 +403,13 @@ class LTOBackupSystem:
     
     def show_config(self):
         """Показать текущую конфигурацию"""
-        import yaml
-        
         print("=" * 60)
         print("Текущая конфигурация LTO Backup")
         print(f"Файл: {self.config_path}")
         print("=" * 60)
         
-        with open(self.config_path, 'r', encoding='utf-8') as f:
-            config_content = yaml.safe_load(f)
-            print(yaml.dump(config_content, default_flow_style=False, allow_unicode=True, indent=2))
+        # Конфигурация уже разобрана ConfigManager: файл повторно не читаем
+        print(yaml.dump(self.config.config, Dumper=SafeDumper, default_flow_style=False, allow_unicode=True, indent=2))
     
     def validate_config(self):
         """Проверить валидность конфигурации"""
@@ -315,13 +431,19 @@ class LTOBackupSystem:
         print("=" * 60)
         
         # Статистика реестра
-        backups = self.registry.list_backups()
+        backups = self._get_backups()
         print(f"\n📊 Статистика бэкапов:")
         print(f"  Всего бэкапов: {len(backups)}")
         
         if backups:
-            oldest = min(backups, key=lambda x: x['timestamp'])
-            newest = max(backups, key=lambda x: x['timestamp'])
+            # Самый старый и самый новый бэкап за один проход
+            oldest = newest = backups[0]
+            for backup in backups:
+                timestamp = backup['timestamp']
+                if timestamp < oldest['timestamp']:
+                    oldest = backup
+                elif timestamp > newest['timestamp']:
+                    newest = backup
             print(f"  Самый старый: {oldest['timestamp']} ({oldest['label']})")
             print(f"  Самый новый: {newest['timestamp']} ({newest['label']})")
         
@@ -332,19 +454,18 @@ class LTOBackupSystem:
         print(f"  Последняя чистка: {tape_stats.get('last_cleaning', 'Нет данных')}")
         
         # Статистика использования лент
-        used_tapes = self.tape_driver.get_used_tapes()
-        if used_tapes != "N/A":
-            tape_count = len(used_tapes.split())
+        tape_count = self.tape_driver.get_used_tape_count()
+        if tape_count:
             print(f"  Использовано лент: {tape_count}")
         
         # Проверка дискового пространства
         print(f"\n💿 Дисковое пространство:")
         try:
-            import shutil
+            gb = 1 << 30
             total, used, free = shutil.disk_usage("/")
-            print(f"  Всего: {total // (2**30)} GB")
-            print(f"  Использовано: {used // (2**30)} GB")
-            print(f"  Свободно: {free // (2**30)} GB ({free/total*100:.1f}%)")
+            print(f"  Всего: {total // gb} GB")
+            print(f"  Использовано: {used // gb} GB")
+            print(f"  Свободно: {free // gb} GB ({free * 100 / total:.1f}%)")
         except:
             print("  Не удалось получить информацию о диске")
         
@@ -352,15 +473,9 @@ class LTOBackupSystem:
     
     def version(self):
         """Показать версию"""
-        version_info = f"""
-LTO Backup System v2.0.0
-Binary: {'Yes' if self.is_binary else 'No'}
-Python: {sys.version}
-Platform: {sys.platform}
-Config: {self.config_path}
-YAML Config: Yes
-        """
-        print(version_info.strip())
+        print(VERSION_INFO)
+        print(f"Config: {self.config_path}")
+        print("YAML Config: Yes")
     
     def run_scheduler(self):
         """Запустить планировщик"""
@@ -374,8 +489,8 @@ YAML Config: Yes
         
         return self.scheduler.run()
 
-def main():
-    """Точка входа"""
+def _build_parser():
+    """Парсер аргументов командной строки"""
     parser = argparse.ArgumentParser(
         description="LTO Backup System - Профессиональная система резервного копирования на ленту",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -418,13 +533,20 @@ def main():
         action='store_true',
         help='Показать версию'
     )
-    
+
+    return parser
+
+# Парсер строится один раз при импорте модуля
+PARSER = _build_parser()
+
+def main():
+    """Точка входа"""
+    parser = PARSER
     args = parser.parse_args()
     
     # Показать версию если запрошено
     if args.version:
-        system = LTOBackupSystem(args.config)
-        system.version()
+        print(VERSION_INFO)
         sys.exit(0)
     
     # Если команда не указана, показать помощь
@@ -1,4 +1,7 @@
+import atexit
 import logging
+import queue
+import threading
 from typing import Optional, Dict, Any
 from telegram import Bot
 from telegram.error import TelegramError
@@ -13,6 +16,11 @@ class TelegramBot:
         self.config = config
         self.enabled = config.get_telegram_enabled()
         
+        # Очередь отправки: сетевые запросы выполняются в фоновом потоке
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        
         if self.enabled:
             self.token = config.get('telegram', 'token')
             self.chat_id = config.get('telegram', 'chat_id')
@@ -57,11 +65,54 @@ class TelegramBot:
         
         return current_level >= config_level
     
-    def send_message(self, text: str, level: str = "INFO", parse_mode: Optional[str] = "Markdown") -> bool:
-        """Отправить сообщение в Telegram"""
+    def _ensure_worker(self) -> None:
+        """Запустить фоновый поток отправки при первом сообщении"""
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._worker_loop,
+                    name="TelegramSender",
+                    daemon=True
+                )
+                self._worker.start()
+                atexit.register(self.close)
+    
+    def _worker_loop(self) -> None:
+        """Отправлять сообщения из очереди по порядку"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._deliver(*item)
+    
+    def close(self, timeout: float = 30.0) -> None:
+        """Дождаться отправки сообщений из очереди и остановить поток"""
+        with self._worker_lock:
+            worker, self._worker = self._worker, None
+        
+        if worker is not None:
+            self._queue.put(None)
+            worker.join(timeout)
+    
+    def send_message(self, text: str, level: str = "INFO", parse_mode: Optional[str] = "Markdown",
+                     wait: bool = False) -> bool:
+        """Отправить сообщение в Telegram
+        
+        По умолчанию сообщение ставится в очередь и отправляется в фоне,
+        при wait=True отправка выполняется сразу и возвращается ее результат.
+        """
         if not self._should_notify(level):
             return False
         
+        if wait:
+            return self._deliver(text, level, parse_mode)
+        
+        self._ensure_worker()
+        self._queue.put((text, level, parse_mode))
+        return True
+    
+    def _deliver(self, text: str, level: str, parse_mode: Optional[str]) -> bool:
+        """Выполнить отправку сообщения через Bot API"""
         try:
             # Добавляем эмодзи в зависимости от уровня
             if level == "ERROR":
@@ -2,6 +2,7 @@ import subprocess
 import sys
 import shutil
 import logging
+from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
@@ -69,7 +70,7 @@ class DependencyChecker:
             config = ConfigManager()
             tape_dev = config.get('hardware', 'tape_dev', '/dev/nst0')
             
-            if Path(tape_dev).exists():
+            if config.tape_dev_stat is not None:
                 try:
                     # Пробуем открыть устройство
                     with open(tape_dev, 'rb') as f: